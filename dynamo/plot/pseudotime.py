@@ -25,11 +25,8 @@ def plot_direct_graph(
         edge_attr="weight",
         create_using=nx.DiGraph(),
     )
-    G.nodes()
-    W = []
-    for n, nbrs in G.adj.items():
-        for nbr, eattr in nbrs.items():
-            W.append(eattr["weight"])
+    # edge widths have to follow the graph's edge order, which may differ from the row order of df_mat
+    W = np.fromiter((w for _, _, w in G.edges(data="weight")), dtype=float, count=G.number_of_edges())
 
     options = {
         "width": 300,
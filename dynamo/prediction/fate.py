@@ -104,7 +104,8 @@ def fate(
             Number of cores to calculate path integral for predicting cell fate. If cores is set to be > 1,
             multiprocessing will be used to parallel the fate prediction.
         kwargs:
-            Additional parameters that will be passed into the fate function.
+            Additional parameters that will be passed into the fate function, e.g. `step_size`, `batch` or `n_steps`
+            (see `_fate`).
 
     Returns
     -------
@@ -233,6 +234,8 @@ def _fate(
     average=True,
     sampling="arc_length",
     cores=1,
+    batch=False,
+    n_steps=250,
 ):
     """Predict the historical and future cell transcriptomic states over arbitrary time scales by integrating vector
     field functions from one or a set of initial cell state(s).
@@ -267,6 +270,11 @@ def _fate(
         cores: `int` (default: 1):
             Number of cores to calculate path integral for predicting cell fate. If cores is set to be > 1,
             multiprocessing will be used to parallel the fate prediction.
+        batch: `bool` (default: False):
+            Whether to integrate all initial cell states together as one stacked system with a single call of the ODE
+            solver instead of one call per cell. Only used when `cores` is 1.
+        n_steps: `int` (default: 250):
+            The number of time points between 0 and `t_end` when `step_size` is None.
 
     Returns
     -------
@@ -280,7 +288,7 @@ def _fate(
         cell state at each time point is calculated for all cells.
     """
 
-    t_linspace = getTseq(init_states, t_end, step_size)
+    t_linspace = getTseq(init_states, t_end, step_size, n_steps)
 
     if cores == 1:
         t, prediction = integrate_vf_ivp(
@@ -291,6 +299,7 @@ def _fate(
             interpolation_num=interpolation_num,
             average=average,
             sampling=sampling,
+            batch=batch,
         )
     else:
         pool = ThreadPool(cores)
@@ -318,10 +327,8 @@ def _fate(
 
         if init_states.shape[0] > 1 and average:
             t_len = int(len(t_stack) / n_cell)
-            avg = np.zeros((n_feature, t_len))
-
-            for i in range(t_len):
-                avg[:, i] = np.mean(prediction_stack[:, np.arange(n_cell) * t_len + i], 1)
+            # columns are stacked cell by cell, so average over the cell axis in one reduction
+            avg = prediction_stack.reshape((n_feature, n_cell, t_len)).mean(1)
 
             prediction = [avg]
             t = [np.sort(np.unique(t))]
@@ -1,13 +1,17 @@
+from functools import lru_cache
 from typing import Callable, Union
 
 import networkx as nx
 import numpy as np
 from anndata import AnnData
+from numba import jit
 from scipy.interpolate import interp1d
 from scipy.optimize import minimize
+from scipy.sparse.csgraph import shortest_path
+from scipy.spatial import cKDTree
 
 from ..dynamo_logger import LoggerManager
-from ..tools.utils import fetch_states, nearest_neighbors
+from ..tools.utils import fetch_states
 from ..vectorfield import SvcVectorField
 from ..vectorfield.utils import (
     vector_field_function_transformation,
@@ -17,15 +21,26 @@ from .trajectory import GeneTrajectory, Trajectory
 from .utils import arclength_sampling_n, find_elbow, pca_to_expr
 
 
+def _as_float(x):
+    # the numba kernels are compiled per argument type; D and dt may be ints or, from `minimize`, 1-element arrays
+    return float(np.asarray(x).item())
+
+
+@jit(nopython=True)
+def _action_kernel(path, fx, D, dt):
+    v = (path[1:] - path[:-1]) / dt
+
+    s = v - fx
+    s = 0.5 * np.sum(s * s) * dt / D
+
+    return s
+
+
 def action(path, vf_func, D=1, dt=1):
     # centers
     x = (path[:-1] + path[1:]) * 0.5
-    v = np.diff(path, axis=0) / dt
 
-    s = (v - vf_func(x)).flatten()
-    s = 0.5 * s.dot(s) * dt / D
-
-    return s
+    return _action_kernel(path, vf_func(x), _as_float(D), _as_float(dt))
 
 
 def action_aux(path_flatten, vf_func, dim, start=None, end=None, **kwargs):
@@ -33,46 +48,110 @@ def action_aux(path_flatten, vf_func, dim, start=None, end=None, **kwargs):
     return action(path, vf_func, **kwargs)
 
 
-def action_grad(path, vf_func, jac_func, D=1, dt=1):
-    x = (path[:-1] + path[1:]) * 0.5
-    v = np.diff(path, axis=0) / dt
+@jit(nopython=True)
+def _action_grad_kernel(path, fx, J, D, dt):
+    v = (path[1:] - path[:-1]) / dt
 
-    dv = v - vf_func(x)
-    J = jac_func(x)
-    z = np.zeros(dv.shape)
-    for s in range(dv.shape[0]):
-        z[s] = dv[s] @ J[:, :, s]
+    dv = v - fx
+    n, dim = dv.shape
+    z = np.zeros((n, dim))
+    for s in range(n):
+        for i in range(dim):
+            for j in range(dim):
+                z[s, j] += dv[s, i] * J[i, j, s]
     grad = (dv[:-1] - dv[1:]) / D - dt / (2 * D) * (z[:-1] + z[1:])
     return grad
 
 
+def action_grad(path, vf_func, jac_func, D=1, dt=1):
+    x = (path[:-1] + path[1:]) * 0.5
+
+    return _action_grad_kernel(path, vf_func(x), jac_func(x), _as_float(D), _as_float(dt))
+
+
 def action_grad_aux(path_flatten, vf_func, jac_func, dim, start=None, end=None, **kwargs):
     path = reshape_path(path_flatten, dim, start=start, end=end)
     return action_grad(path, vf_func, jac_func, **kwargs).flatten()
 
 
-def reshape_path(path_flatten, dim, start=None, end=None):
+def action_and_grad(path, vf_func, jac_func, D=1, dt=1):
+    # the action and its gradient share the vector field evaluated at the centers
+    x = (path[:-1] + path[1:]) * 0.5
+    fx = vf_func(x)
+    D, dt = _as_float(D), _as_float(dt)
+
+    return _action_kernel(path, fx, D, dt), _action_grad_kernel(path, fx, jac_func(x), D, dt)
+
+
+def action_and_grad_aux(path_flatten, vf_func, jac_func, dim, start=None, end=None, out=None, **kwargs):
+    path = reshape_path(path_flatten, dim, start=start, end=end, out=out)
+    s, grad = action_and_grad(path, vf_func, jac_func, **kwargs)
+    return s, grad.flatten()
+
+
+def reshape_path(path_flatten, dim, start=None, end=None, out=None):
+    """Reshape the flattened path and add the start and end points. The full path is written into `out` if given,
+    which avoids allocating a new path when this is called repeatedly during optimization."""
     path = path_flatten.reshape(int(len(path_flatten) / dim), dim)
+    if start is None and end is None:
+        return path
+
+    i_0 = 0 if start is None else 1
+    if out is None:
+        dtype = np.result_type(*[p for p in (start, path, end) if p is not None])
+        out = np.empty((len(path) + i_0 + (end is not None), dim), dtype=dtype)
     if start is not None:
-        path = np.vstack((start, path))
+        out[0] = start
+    out[i_0 : i_0 + len(path)] = path
     if end is not None:
-        path = np.vstack((path, end))
-    return path
+        out[-1] = end
+    return out
+
 
+@lru_cache(maxsize=8)
+def sine_basis(n_points, n_modes):
+    """The sine series sin(k * pi * t) evaluated at the interior points of a path with `n_points` points, for
+    k = 1, ..., n_modes. All modes vanish at both ends of the path, so adding them to a path keeps its ends fixed.
+    The basis is cached (and read-only) since it is reused across EM steps and LAPs of the same length."""
+    t = np.linspace(0, 1, n_points)[1:-1]
+    B = np.sin(np.pi * np.outer(np.arange(1, n_modes + 1), t))
+    B.setflags(write=False)
+    return B
 
-def lap_T(path_0, T, vf_func, jac_func, D=1):
+
+def lap_T(path_0, T, vf_func, jac_func, D=1, n_modes=None):
     n = len(path_0)
     dt = T / (n - 1)
     dim = len(path_0[0])
+    path_buffer = np.empty((n, dim))
+
+    if n_modes is None:
+        # optimize the coordinates of the interior points directly
+        def fun_and_jac(x):
+            return action_and_grad_aux(
+                x, vf_func, jac_func, dim, start=path_0[0], end=path_0[-1], out=path_buffer, D=D, dt=dt
+            )
+
+        x_0 = path_0[1:-1].flatten()
+    else:
+        # optimize the coefficients of a truncated sine series added to the initial path
+        B = sine_basis(n, n_modes)
+        path_0_interior = path_0[1:-1]
+
+        def to_path(a):
+            return (path_0_interior + B.T @ a.reshape(n_modes, dim)).flatten()
 
-    def fun(x):
-        return action_aux(x, vf_func, dim, start=path_0[0], end=path_0[-1], D=D, dt=dt)
+        def fun_and_jac(a):
+            s, grad = action_and_grad_aux(
+                to_path(a), vf_func, jac_func, dim, start=path_0[0], end=path_0[-1], out=path_buffer, D=D, dt=dt
+            )
+            return s, (B @ grad.reshape(-1, dim)).flatten()
 
-    def jac(x):
-        return action_grad_aux(x, vf_func, jac_func, dim, start=path_0[0], end=path_0[-1], D=D, dt=dt)
+        x_0 = np.zeros(n_modes * dim)
 
-    sol_dict = minimize(fun, path_0[1:-1], jac=jac)
-    path_sol = reshape_path(sol_dict["x"], dim, start=path_0[0], end=path_0[-1])
+    sol_dict = minimize(fun_and_jac, x_0, jac=True, method="L-BFGS-B")
+    x_sol = sol_dict["x"] if n_modes is None else to_path(sol_dict["x"])
+    path_sol = reshape_path(x_sol, dim, start=path_0[0], end=path_0[-1])
 
     # further optimization by varying dt
     t_dict = minimize(lambda t: action(path_sol, vf_func, D=D, dt=t), dt)
@@ -82,7 +161,9 @@ def lap_T(path_0, T, vf_func, jac_func, D=1):
     return path_sol, dt_sol, action_opt
 
 
-def least_action_path(start, end, vf_func, jac_func, n_points=20, init_path=None, D=1, dt_0=1, EM_steps=2):
+def least_action_path(
+    start, end, vf_func, jac_func, n_points=20, init_path=None, D=1, dt_0=1, EM_steps=2, n_modes=None
+):
     if init_path is None:
         path = (
             np.tile(start, (n_points + 1, 1))
@@ -97,7 +178,7 @@ def least_action_path(start, end, vf_func, jac_func, n_points=20, init_path=None
 
     while EM_steps > 0:
         EM_steps -= 1
-        path, dt, action_opt = lap_T(path, dt * len(path), vf_func, jac_func, D=D)
+        path, dt, action_opt = lap_T(path, dt * len(path), vf_func, jac_func, D=D, n_modes=n_modes)
 
     return path, dt, action_opt
 
@@ -119,11 +200,23 @@ def minimize_lap_time(path_0, t0, t_min, vf_func, jac_func, D=1, num_t=20, elbow
     return i_elbow, laps, A, opt_T
 
 
-def get_init_path(G, start, end, coords, interpolation_num=20):
-    source_ind = nearest_neighbors(start, coords, k=1)[0][0]
-    target_ind = nearest_neighbors(end, coords, k=1)[0][0]
+def get_init_path(G, start, end, coords, interpolation_num=20, tree=None):
+    # the kd-tree of coords can be passed in to reuse it for many pairs of start and end points
+    tree = cKDTree(coords) if tree is None else tree
+    source_ind = tree.query(start, k=1)[1]
+    target_ind = tree.query(end, k=1)[1]
 
-    path = nx.shortest_path(G, source_ind, target_ind)
+    if isinstance(G, nx.Graph):
+        path = nx.shortest_path(G, source_ind, target_ind)
+    else:
+        # unweighted shortest path in the undirected graph of the adjacency matrix, same as networkx's default
+        _, predecessors = shortest_path(
+            G, directed=False, unweighted=True, indices=source_ind, return_predecessors=True
+        )
+        path = [target_ind]
+        while path[-1] != source_ind:
+            path.append(predecessors[path[-1]])
+        path = path[::-1]
     init_path = coords[path, :]
 
     # _, arclen, _ = remove_redundant_points_trajectory(init_path, tol=1e-4, output_discard=True)
@@ -204,7 +297,10 @@ def least_action(
         add_key:
             The key name that will be used to store the calculated least action path information.
         kwargs:
-            Additional argument passed to least_action_path function.
+            Additional argument passed to least_action_path function. Paths are optimized with L-BFGS-B (previously
+            BFGS, so optimized paths may differ slightly from earlier versions). If `n_modes` is given, instead of the
+            coordinates of every way point, the coefficients of `n_modes` sine modes added to the initial path (the
+            shortest path in the transition graph, or `init_paths`) are optimized, which keeps the end points fixed.
 
     Returns
     -------
@@ -219,11 +315,14 @@ def least_action(
         vf.from_adata(adata, basis=basis, vf_key=vf_key)
     else:
         vf = vecfld
+    # the action and its gradient evaluate the vector field and its Jacobian on all points of a path at once, so use
+    # the vectorized analytical Jacobian instead of a loop over the points where it is available
+    jac_func = vf.get_Jacobian(vectorize=True) if isinstance(vf, SvcVectorField) else vf.get_Jacobian()
 
     coords = adata.obsm["X_" + basis]
 
-    T = adata.obsp[adj_key]
-    G = nx.convert_matrix.from_scipy_sparse_matrix(T)
+    G = adata.obsp[adj_key]
+    tree = cKDTree(coords) if init_paths is None else None
 
     init_states, _, _, _ = fetch_states(
         adata,
@@ -280,7 +379,7 @@ def least_action(
             indent_level=2,
         )
         if init_paths is None:
-            init_path = get_init_path(G, init_state, target_state, coords, interpolation_num=n_points)
+            init_path = get_init_path(G, init_state, target_state, coords, interpolation_num=n_points, tree=tree)
         else:
             init_path = init_paths if type(init_paths) == np.ndarray else init_paths[path_ind]
 
@@ -290,7 +389,7 @@ def least_action(
             indent_level=2,
         )
         path_sol, dt_sol, action_opt = least_action_path(
-            init_state, target_state, vf.func, vf.get_Jacobian(), n_points=n_points, init_path=init_path, D=D, **kwargs
+            init_state, target_state, vf.func, jac_func, n_points=n_points, init_path=init_path, D=D, **kwargs
         )
 
         n_points = len(path_sol)  # the actual #points due to arclength resampling
@@ -299,7 +398,7 @@ def least_action(
             t_sol = dt_sol * (n_points - 1)
             t_min = 0.3 * t_sol
             i_elbow_, laps_, A_, opt_T_ = minimize_lap_time(
-                path_sol, t_sol, t_min, vf.func, vf.get_Jacobian(), D=D, num_t=num_t, elbow_method=elbow_method
+                path_sol, t_sol, t_min, vf.func, jac_func, D=D, num_t=num_t, elbow_method=elbow_method
             )
             if i_elbow_ is None:
                 i_elbow_ = 0
@@ -363,8 +462,11 @@ class LeastActionPath(Trajectory):
         self.func = vf_func
         self.D = D
         self._action = np.zeros(X.shape[0])
-        for i in range(1, len(self._action)):
-            self._action[i] = action(self.X[: i + 1], self.func, self.D, dt)
+        # the action is a sum over segments, so the action up to each point is a cumulative sum
+        x = (self.X[:-1] + self.X[1:]) * 0.5
+        v = np.diff(self.X, axis=0) / dt
+        s = v - self.func(x)
+        self._action[1:] = np.cumsum(0.5 * np.einsum("ij, ij -> i", s, s) * dt / self.D)
 
     def get_t(self):
         return self.t
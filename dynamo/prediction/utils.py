@@ -2,6 +2,7 @@ from typing import Callable
 
 # from anndata._core.views import ArrayView
 import numpy as np
+from numba import jit
 from scipy import interpolate
 from scipy.integrate import solve_ivp
 from tqdm import tqdm
@@ -68,6 +69,67 @@ def init_l0_chase(l, gamma, t):
 # integration related
 
 
+def _solve_ivp_in_direction(f, y0, t, integration_direction, args=None, max_step=np.inf):
+    """solve the initial value problem of `f` starting from `y0` forward, backward or in both directions of time"""
+    ivp_f, ivp_f_event = (
+        lambda t, x, *args: f(x, *args),
+        lambda t, x, *args: np.all(abs(f(x, *args)) < 1e-5) - 1,
+        # np.linalg.norm(np.abs(f(x))) - 1e-5 if velocity on all dimension is less than 1e-5
+    )
+    ivp_f_event.terminal = True
+
+    if integration_direction == "forward":
+        y_ivp = solve_ivp(
+            ivp_f,
+            [t[0], t[-1]],
+            y0,
+            events=ivp_f_event,
+            args=args,
+            max_step=max_step,
+            dense_output=True,
+        )
+        y, t_trans, sol = y_ivp.y, y_ivp.t, y_ivp.sol
+    elif integration_direction == "backward":
+        y_ivp = solve_ivp(
+            ivp_f,
+            [-t[0], -t[-1]],
+            y0,
+            events=ivp_f_event,
+            args=args,
+            max_step=max_step,
+            dense_output=True,
+        )
+        y, t_trans, sol = y_ivp.y, y_ivp.t, y_ivp.sol
+    elif integration_direction == "both":
+        y_ivp_f = solve_ivp(
+            ivp_f,
+            [t[0], t[-1]],
+            y0,
+            events=ivp_f_event,
+            args=args,
+            max_step=max_step,
+            dense_output=True,
+        )
+        y_ivp_b = solve_ivp(
+            ivp_f,
+            [-t[0], -t[-1]],
+            y0,
+            events=ivp_f_event,
+            args=args,
+            max_step=max_step,
+            dense_output=True,
+        )
+        y, t_trans = (
+            np.hstack((y_ivp_b.y[:, ::-1], y_ivp_f.y)),
+            np.hstack((y_ivp_b.t[::-1], y_ivp_f.t)),
+        )
+        sol = [y_ivp_b.sol, y_ivp_f.sol]
+    else:
+        raise Exception("both, forward, backward are the only valid direction argument strings")
+
+    return y, t_trans, sol
+
+
 def integrate_vf_ivp(
     init_states,
     t,
@@ -79,8 +141,13 @@ def integrate_vf_ivp(
     sampling="arc_length",
     verbose=False,
     disable=False,
+    batch=False,
 ):
-    """integrating along vector field function using the initial value problem solver from scipy.integrate"""
+    """integrating along vector field function using the initial value problem solver from scipy.integrate
+
+    If `batch` is True, the states of all cells are stacked into a single system that is solved with one call of the
+    solver, which requires `f` to accept a 2d array of row vectors. The cells then share the adaptive step sizes and
+    the integration only terminates early once all cells have reached a fixed point."""
 
     # TODO: rewrite this function with the Trajectory class
     if init_states.ndim == 1:
@@ -93,72 +160,41 @@ def integrate_vf_ivp(
     if interpolation_num is not None and integration_direction == "both":
         interpolation_num = interpolation_num * 2
 
-    for i in tqdm(range(n_cell), desc="integration with ivp solver", disable=disable):
-        y0 = init_states[i, :]
-        ivp_f, ivp_f_event = (
-            lambda t, x: f(x),
-            lambda t, x: np.all(abs(f(x)) < 1e-5) - 1,
-            # np.linalg.norm(np.abs(f(x))) - 1e-5 if velocity on all dimension is less than 1e-5
+    if batch and n_cell > 1:
+        if verbose:
+            print("\nintegrating ", n_cell, " cells in a batch")
+        y, t_trans, sol = _solve_ivp_in_direction(
+            lambda x, *args: f(x.reshape((n_cell, n_feature)), *args).flatten(),
+            init_states.flatten(),
+            t,
+            integration_direction,
+            args=args,
+            max_step=max_step,
         )
-        ivp_f_event.terminal = True
+        y = y.reshape((n_cell, n_feature, -1))
+        sols = sol if integration_direction == "both" else [sol]
+        for i in range(n_cell):
+            T.append(t_trans)
+            Y.append(y[i])
+            cell_sol = [lambda t_, s=s, i=i: s(t_).reshape((n_cell, n_feature, -1))[i] for s in sols]
+            SOL.append(cell_sol if integration_direction == "both" else cell_sol[0])
 
         if verbose:
-            print("\nintegrating cell ", i, "; Initial state: ", init_states[i, :])
-        if integration_direction == "forward":
-            y_ivp = solve_ivp(
-                ivp_f,
-                [t[0], t[-1]],
-                y0,
-                events=ivp_f_event,
-                args=args,
-                max_step=max_step,
-                dense_output=True,
-            )
-            y, t_trans, sol = y_ivp.y, y_ivp.t, y_ivp.sol
-        elif integration_direction == "backward":
-            y_ivp = solve_ivp(
-                ivp_f,
-                [-t[0], -t[-1]],
-                y0,
-                events=ivp_f_event,
-                args=args,
-                max_step=max_step,
-                dense_output=True,
-            )
-            y, t_trans, sol = y_ivp.y, y_ivp.t, y_ivp.sol
-        elif integration_direction == "both":
-            y_ivp_f = solve_ivp(
-                ivp_f,
-                [t[0], t[-1]],
-                y0,
-                events=ivp_f_event,
-                args=args,
-                max_step=max_step,
-                dense_output=True,
-            )
-            y_ivp_b = solve_ivp(
-                ivp_f,
-                [-t[0], -t[-1]],
-                y0,
-                events=ivp_f_event,
-                args=args,
-                max_step=max_step,
-                dense_output=True,
-            )
-            y, t_trans = (
-                np.hstack((y_ivp_b.y[::-1, :], y_ivp_f.y)),
-                np.hstack((y_ivp_b.t[::-1], y_ivp_f.t)),
+            print("\nintegration time: ", len(t_trans))
+    else:
+        for i in tqdm(range(n_cell), desc="integration with ivp solver", disable=disable):
+            if verbose:
+                print("\nintegrating cell ", i, "; Initial state: ", init_states[i, :])
+            y, t_trans, sol = _solve_ivp_in_direction(
+                f, init_states[i, :], t, integration_direction, args=args, max_step=max_step
             )
-            sol = [y_ivp_b.sol, y_ivp_f.sol]
-        else:
-            raise Exception("both, forward, backward are the only valid direction argument strings")
 
-        T.append(t_trans)
-        Y.append(y)
-        SOL.append(sol)
+            T.append(t_trans)
+            Y.append(y)
+            SOL.append(sol)
 
-        if verbose:
-            print("\nintegration time: ", len(t_trans))
+            if verbose:
+                print("\nintegration time: ", len(t_trans))
 
     if sampling == "arc_length":
         Y_, t_ = [None] * n_cell, [None] * n_cell
@@ -259,7 +295,7 @@ def integrate_vf_ivp(
 
             valid_t_trans = np.hstack((t_0, t_1))
 
-        _Y = None
+        _Y = [None] * n_cell
         if integration_direction == "both":
             neg_t_len = sum(valid_t_trans < 0)
         for i in tqdm(
@@ -267,7 +303,7 @@ def integrate_vf_ivp(
             desc="calculate solutions on the sampled time points in logspace",
             disable=disable,
         ):
-            cur_Y = (
+            _Y[i] = (
                 SOL[i](valid_t_trans)
                 if integration_direction != "both"
                 else np.hstack(
@@ -277,18 +313,12 @@ def integrate_vf_ivp(
                     )
                 )
             )
-            _Y = cur_Y if _Y is None else np.hstack((_Y, cur_Y))
 
-        t, Y = valid_t_trans, _Y
+        t, Y = valid_t_trans, np.hstack(_Y)
 
-        # TODO: this part is buggy, need to fix
         if n_cell > 1 and average:
-            t_len = int(len(t) / n_cell)
-            avg = np.zeros((n_feature, t_len))
-
-            for i in range(t_len):
-                avg[:, i] = np.mean(Y[:, np.arange(n_cell) * t_len + i], 1)
-            Y = avg
+            # columns are laid out as (cell, time point) and every cell is sampled at the same valid_t_trans
+            Y = Y.reshape((n_feature, n_cell, len(t))).mean(1)
 
         Y = Y.T
 
@@ -362,12 +392,13 @@ def integrate_streamline(
     import matplotlib.pyplot as plt
 
     n_cell = init_states.shape[0]
+    t_linspace, res = None, []
 
-    res = np.zeros((n_cell * interpolation_num, 2))
-    j = -1  # this index will become 0 when the first trajectory found
-
+    # reuse a single axes and drop the artists after each call so that the streamplot cost doesn't grow with the
+    # number of collections accumulated on the axes.
+    fig, ax = plt.subplots()
     for i in tqdm(range(n_cell), "integration with streamline"):
-        strm = plt.streamplot(
+        strm = ax.streamplot(
             X,
             Y,
             U,
@@ -377,32 +408,26 @@ def integrate_streamline(
             density=100,
         )
         strm_res = np.array(strm.lines.get_segments()).reshape((-1, 2))
+        strm.lines.remove()
+        for arrow in list(ax.patches):
+            arrow.remove()
 
         if len(strm_res) == 0:
             continue
-        else:
-            j += 1
+
         t = np.arange(strm_res.shape[0])
         t_linspace = np.linspace(t[0], t[-1], interpolation_num)
         f = interpolate.interp1d(t, strm_res.T)
+        res.append(f(t_linspace).T)
 
-        cur_rng = np.arange(j * interpolation_num, (j + 1) * interpolation_num)
-        res[cur_rng, :] = f(t_linspace).T
+    plt.close(fig)
 
-    res = res[: cur_rng[-1], :]  # remove all empty trajectories
-    n_cell = int(res.shape[0] / interpolation_num)
+    # only trajectories that were found are kept
+    res = np.vstack(res) if len(res) > 0 else np.zeros((0, 2))
+    n_cell = len(res) // interpolation_num
 
     if n_cell > 1 and average:
-        t_len = len(t_linspace)
-        avg = np.zeros((t_len, 2))
-
-        for i in range(t_len):
-            cur_rng = np.arange(n_cell) * t_len + i
-            avg[i, :] = np.mean(res[cur_rng, :], 0)
-
-        res = avg
-
-    plt.close()
+        res = res.reshape((n_cell, interpolation_num, 2)).mean(0)
 
     return t_linspace, res
 
@@ -414,20 +439,10 @@ def remove_redundant_points_trajectory(X, tol=1e-4, output_discard=False):
     X = np.atleast_2d(X)
     discard = np.zeros(len(X), dtype=bool)
     if X.shape[0] > 1:
-        for i in range(len(X) - 1):
-            dist = np.linalg.norm(X[i + 1] - X[i])
-            if dist < tol:
-                discard[i + 1] = True
+        discard[1:] = np.linalg.norm(np.diff(X, axis=0), axis=1) < tol
         X = X[~discard]
 
-    arclength = 0
-
-    x0 = X[0]
-    for i in range(1, len(X)):
-        tangent = X[i] - x0 if i == 1 else X[i] - X[i - 1]
-        d = np.linalg.norm(tangent)
-
-        arclength += d
+    arclength = np.linalg.norm(np.diff(X, axis=0), axis=1).sum()
 
     if output_discard:
         return (X, arclength, discard)
@@ -435,45 +450,69 @@ def remove_redundant_points_trajectory(X, tol=1e-4, output_discard=False):
         return (X, arclength)
 
 
-def arclength_sampling(X, step_length, t=None):
-    """uniformly sample data points on an arc curve that generated from vector field predictions."""
-    Y = []
-    x0 = X[0]
-    T = [] if t is not None else None
-    t0 = t[0] if t is not None else None
-    i = 1
-    terminate = False
-    arclength = 0
+@jit(nopython=True)
+def _arclength_sampling(X, step_length, t, has_t):
+    """numba kernel of `arclength_sampling`; `t` is ignored unless `has_t` is True."""
+    n, dim = X.shape
+    tangent = np.empty(dim)
 
-    while i < len(X) - 1 and not terminate:
-        L = 0
-        for j in range(i, len(X)):
-            tangent = X[j] - x0 if j == i else X[j] - X[j - 1]
-            d = np.linalg.norm(tangent)
+    arclen_total = 0.0
+    for j in range(1, n):
+        arclen_total += np.sqrt(np.sum((X[j] - X[j - 1]) ** 2))
+    # every sampled point advances `step_length` along the curve
+    max_count = n + int(arclen_total / step_length) + 2
+    Y, T = np.empty((max_count, dim)), np.empty(max_count)
+
+    x0 = X[0].copy()
+    t0 = t[0] if has_t else 0.0
+    i, count = 1, 0
+    terminate = False
+    arclength, L, d = 0.0, 0.0, 0.0
+
+    while i < n - 1 and not terminate:
+        L = 0.0
+        j = i
+        while j < n:
+            x = x0 if j == i else X[j - 1]
+            for k in range(dim):
+                tangent[k] = X[j, k] - x[k]
+            d = np.sqrt(np.sum(tangent ** 2))
             if L + d >= step_length:
-                x = x0 if j == i else X[j - 1]
-                y = x + (step_length - L) * tangent / d
-                if t is not None:
+                Y[count] = x + (step_length - L) * tangent / d
+                if has_t:
                     tau = t0 if j == i else t[j - 1]
                     tau += (step_length - L) / d * (t[j] - tau)
-                    T.append(tau)
+                    T[count] = tau
                     t0 = tau
-                Y.append(y)
-                x0 = y
+                x0 = Y[count].copy()
+                count += 1
                 i = j
                 break
             else:
                 L += d
-        if j == len(X) - 1:
+            j += 1
+        if j >= n - 1:
             i += 1
         arclength += step_length
         if L + d < step_length:
             terminate = True
 
-    if T is not None:
-        return np.array(Y), arclength, T
+    return Y[:count], arclength, T[:count]
+
+
+def arclength_sampling(X, step_length, t=None):
+    """uniformly sample data points on an arc curve that generated from vector field predictions."""
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    has_t = t is not None
+    t = np.asarray(t, dtype=np.float64) if has_t else np.zeros(1)
+    Y, arclength, T = _arclength_sampling(X, float(step_length), t, has_t)
+    if len(Y) == 0:
+        Y = np.array([])
+
+    if has_t:
+        return Y, arclength, T.tolist()
     else:
-        return np.array(Y), arclength
+        return Y, arclength
 
 
 def arclength_sampling_n(X, num, t=None):
@@ -529,27 +568,31 @@ def fetch_exprs(adata, basis, layer, genes, time, mode, project_back_to_high_dim
         time = time[traj_ind]
 
     if mode.lower() not in ["vector_field", "lap"]:
-        valid_genes = list(set(genes).intersection(adata.var.index))
+        gene_mask = adata.var.index.isin(genes)
+        valid_genes = list(adata.var.index[gene_mask])
 
+        # index the underlying arrays directly instead of building AnnData views of the slices
         if layer == "X":
-            exprs = adata[np.isfinite(time), :][:, valid_genes].X
+            exprs = adata.X[np.isfinite(time)][:, gene_mask]
         elif layer in adata.layers.keys():
-            exprs = adata[np.isfinite(time), :][:, valid_genes].layers[layer]
+            exprs = adata.layers[layer][np.isfinite(time)][:, gene_mask]
             exprs = log1p_(adata, exprs)
         elif layer == "protein":  # update subset here
-            exprs = adata[np.isfinite(time), :][:, valid_genes].obsm[layer]
+            exprs = adata.obsm[layer][np.isfinite(time)]
         else:
             raise Exception(f"The {layer} you passed in is not existed in the adata object.")
     else:
-        fate_genes = adata.uns[traj_key]["genes"]
-        valid_genes = list(set(genes).intersection(fate_genes))
+        fate_genes = pd.Index(adata.uns[traj_key]["genes"])
+        # keep valid_genes in the same order as the expression columns selected with the mask below
+        valid_mask = fate_genes.isin(genes)
+        valid_genes = list(fate_genes[valid_mask])
 
         if basis is not None:
             if project_back_to_high_dim:
                 exprs = adata.uns[traj_key]["exprs"]
                 if type(exprs) == list:
                     exprs = exprs[traj_ind]
-                exprs = exprs[np.isfinite(time), :][:, pd.Series(fate_genes).isin(valid_genes)]
+                exprs = exprs[np.isfinite(time), :][:, valid_mask]
             else:
                 exprs = adata.uns[traj_key]["prediction"]
                 if type(exprs) == list:
@@ -560,7 +603,7 @@ def fetch_exprs(adata, basis, layer, genes, time, mode, project_back_to_high_dim
             exprs = adata.uns[traj_key]["prediction"]
             if type(exprs) == list:
                 exprs = exprs[traj_ind]
-            exprs = exprs[np.isfinite(time), pd.Series(fate_genes).isin(valid_genes)]
+            exprs = exprs[np.isfinite(time)][:, valid_mask]
 
     time = time[np.isfinite(time)]
 
@@ -1620,10 +1620,13 @@ def highest_frac_genes(
     selected_indices = sorted_indices[:n_top]
     gene_names = _adata.var_names[selected_indices]
 
-    gene_X_percents = gene_mat / cell_expression_sum.reshape([-1, 1])
+    # only the top genes are shown, so select their columns before dividing by the cell totals; dividing the whole
+    # (sparse) matrix would densify it.
+    selected_gene_mat = gene_mat[:, selected_indices]
+    selected_gene_mat = selected_gene_mat.toarray() if issparse(selected_gene_mat) else np.asarray(selected_gene_mat)
 
     # assemble a dataframe
-    selected_gene_X_percents = np.array(gene_X_percents)[:, selected_indices]
+    selected_gene_X_percents = selected_gene_mat / np.asarray(cell_expression_sum).reshape([-1, 1])
     selected_gene_X_percents = np.squeeze(selected_gene_X_percents)
 
     top_genes_df = pd.DataFrame(
@@ -6,6 +6,7 @@ import numpy as np
 import pandas as pd
 import scipy.sparse
 from anndata import AnnData
+from numba import jit
 from scipy.sparse.base import issparse
 from scipy.sparse.csr import csr_matrix
 from sklearn.utils import sparsefuncs
@@ -71,11 +72,8 @@ def _infer_labeling_experiment_type(adata, tkey):
         xx = labeled_frac.A1 if issparse(adata.layers["new"]) else labeled_frac
 
         yy = tkey_val
-        xm, ym = np.mean(xx), np.mean(yy)
-        cov = np.mean(xx * yy) - xm * ym
-        var_x = np.mean(xx * xx) - xm * xm
-
-        k = cov / var_x
+        # only the sign of the regression slope matters, which is the sign of the covariance.
+        k = np.cov(xx, yy, bias=True)[0, 1]
 
         # total labeled RNA amount will increase (decrease) in kinetic (degradation) experiments over time.
         experiment_type = "kin" if k > 0 else "deg"
@@ -119,24 +117,43 @@ def calc_mean_var_dispersion_ndarray(data_mat: np.array, axis=0) -> Tuple[np.nda
     return mean.flatten(), var.flatten(), dispersion.flatten()
 
 
+@jit(nopython=True)
+def _compressed_mean_var(data, indptr, n):
+    """Mean and variance (with denominator `n`) of each major-axis slice of a compressed sparse matrix with `n`
+    entries along its minor axis. Zero means are offset by 1e-7 before the variance is computed."""
+    n_slices = len(indptr) - 1
+    mean, var = np.empty(n_slices), np.empty(n_slices)
+    for i in range(n_slices):
+        s = 0.0
+        for k in range(indptr[i], indptr[i + 1]):
+            s += data[k]
+        mu = s / n
+        if mu == 0:
+            mu += 1e-7  # prevent division by zero
+
+        # squared deviations of the stored entries plus those of the implicit zeros
+        ss = 0.0
+        for k in range(indptr[i], indptr[i + 1]):
+            ss += (data[k] - mu) ** 2
+        mean[i], var[i] = mu, (ss + (n - (indptr[i + 1] - indptr[i])) * mu ** 2) / n
+    return mean, var
+
+
 def calc_mean_var_dispersion_sparse(
     sparse_mat: scipy.sparse.csr_matrix, axis=0
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """Calculate mean, variance and dispersion of data_mat, a scipy sparse matrix."""
-    sparse_mat = sparse_mat.copy()
-    nan_mask = get_nan_or_inf_data_bool_mask(sparse_mat.data)
-    temp_val = (sparse_mat != 0).sum(axis)
-    sparse_mat.data[nan_mask] = 0
-    nan_count = temp_val - (sparse_mat != 0).sum(axis)
-
-    non_nan_count = sparse_mat.shape[axis] - nan_count
-    mean = (sparse_mat.sum(axis) / sparse_mat.shape[axis]).A1
-    mean[mean == 0] += 1e-7  # prevent division by zero
-
-    # same as numpy var behavior: denominator is N, var=(data_arr-mean)/N
-    var = np.power(sparse_mat - mean, 2).sum(axis) / sparse_mat.shape[axis]
+    # compress along the reduced axis so that each output entry is one contiguous slice of the data
+    mat = scipy.sparse.csc_matrix(sparse_mat) if axis == 0 else scipy.sparse.csr_matrix(sparse_mat)
+    if not mat.has_canonical_format:
+        mat = mat.copy()
+        mat.sum_duplicates()
+
+    # nan/inf values are counted as zeros; same as numpy var behavior otherwise: denominator is N
+    data = np.where(get_nan_or_inf_data_bool_mask(mat.data), 0, mat.data).astype(np.float64)
+    mean, var = _compressed_mean_var(data, mat.indptr, mat.shape[axis])
     dispersion = var / mean
-    return np.array(mean).flatten(), np.array(var).flatten(), np.array(dispersion).flatten()
+    return mean, var, dispersion
 
 
 def seurat_get_mean_var(X, ignore_zeros=False, perc=None):
@@ -1357,9 +1374,9 @@ def normalize_cell_expr_by_size_factors(
 
 
 def is_nonnegative(mat: Union[np.ndarray, scipy.sparse.spmatrix, list]):
-    if scipy.sparse.issparse(mat):
-        return np.all(mat.sign().data >= 0)
-    return np.all(np.sign(mat) >= 0)
+    # only the stored entries of a sparse matrix can be negative; nan entries compare as False as before
+    data = mat.data if scipy.sparse.issparse(mat) else np.asarray(mat)
+    return data.size == 0 or data.min() >= 0
 
 
 def is_integer_arr(arr: Union[np.ndarray, scipy.sparse.spmatrix, list]) -> bool:
@@ -1369,6 +1386,10 @@ def is_integer_arr(arr: Union[np.ndarray, scipy.sparse.spmatrix, list]) -> bool:
 def is_float_integer_arr(arr: Union[np.ndarray, scipy.sparse.spmatrix, list]) -> bool:
     if issparse(arr):
         arr = arr.data
+    arr = np.asarray(arr)
+    if np.issubdtype(arr.dtype, np.integer):
+        # integer dtypes can only hold integers, skip the elementwise check
+        return True
     return np.all(np.equal(np.mod(arr, 1), 0))
 
 
@@ -9,7 +9,11 @@ import scipy.sparse
 import statsmodels.api as sm
 from anndata import AnnData
 from scipy.sparse import csr_matrix, issparse
+from scipy.sparse.linalg import LinearOperator, svds
 from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.utils import check_random_state
+from sklearn.utils.extmath import svd_flip
+from sklearn.utils.sparsefuncs import mean_variance_axis
 
 from ..configuration import DKM, DynamoAdataKeyManager
 from ..dynamo_logger import (
@@ -136,7 +140,9 @@ def convert2symbol(adata: AnnData, scopes: Union[str, Iterable, None] = None, su
 def compute_gene_exp_fraction(X: scipy.sparse.spmatrix, threshold: float = 0.001) -> tuple:
     """Calculate fraction of each gene's count to total counts across cells and identify high fraction genes."""
 
-    frac = X.sum(0) / X.sum()
+    # the total count is the sum of the per-gene counts, no need for a second pass over X
+    gene_counts = X.sum(0)
+    frac = gene_counts / gene_counts.sum()
     if issparse(X):
         frac = frac.A.reshape(-1, 1)
 
@@ -572,6 +578,53 @@ def decode(adata):
 # pca
 
 
+def _pca_fit_sparse(X: csr_matrix, n_components: int, random_state: int = 0):
+    """Fit an ARPACK PCA on a sparse matrix without densifying it.
+
+    sklearn's own sparse ARPACK PCA is used where available (sklearn >= 1.4). Older versions reject sparse input, in
+    which case the mean centering is applied implicitly inside the matrix-vector products of a `LinearOperator`.
+    Returns a fitted `PCA` object equivalent to `PCA(n_components, svd_solver="arpack").fit(X.toarray())` together
+    with the transformed data.
+    """
+    fit = PCA(n_components=n_components, svd_solver="arpack", random_state=random_state)
+    try:
+        X_pca = fit.fit_transform(X)
+        return fit, X_pca
+    except TypeError:
+        pass
+
+    if not np.issubdtype(X.dtype, np.floating):
+        X = X.astype(np.float64)
+    n_samples, n_features = X.shape
+    mean, var = mean_variance_axis(X, axis=0)
+
+    X_centered = LinearOperator(
+        shape=X.shape,
+        dtype=X.dtype,
+        matvec=lambda v: X @ v - mean @ v,
+        matmat=lambda V: X @ V - mean @ V,
+        rmatvec=lambda u: X.T @ u - mean * u.sum(),
+        rmatmat=lambda U: X.T @ U - np.outer(mean, U.sum(0)),
+    )
+    # same starting vector and sign convention as the arpack solver of the sklearn versions without sparse support
+    v0 = check_random_state(random_state).uniform(-1, 1, min(X.shape))
+    U, S, Vt = svds(X_centered, k=n_components, tol=0.0, v0=v0)
+    S = S[::-1]
+    U, Vt = svd_flip(U[:, ::-1], Vt[::-1], u_based_decision=True)
+
+    total_var = var.sum() * n_samples / (n_samples - 1)
+    fit.n_features_in_, fit.n_samples_, fit.n_components_ = n_features, n_samples, n_components
+    fit.mean_, fit.components_, fit.singular_values_ = mean, Vt, S.copy()
+    fit.explained_variance_ = S ** 2 / (n_samples - 1)
+    fit.explained_variance_ratio_ = fit.explained_variance_ / total_var
+    if n_components < min(n_features, n_samples):
+        fit.noise_variance_ = (total_var - fit.explained_variance_.sum()) / (min(n_features, n_samples) - n_components)
+    else:
+        fit.noise_variance_ = 0.0
+
+    return fit, U * S
+
+
 def pca_monocle(
     adata: AnnData,
     X_data=None,
@@ -624,13 +677,13 @@ def pca_monocle(
 
     USE_TRUNCATED_SVD_THRESHOLD = 100000
     if adata.n_obs < USE_TRUNCATED_SVD_THRESHOLD:
-        pca = PCA(
-            n_components=min(n_pca_components, X_data.shape[1] - 1),
-            svd_solver="arpack",
-            random_state=0,
-        )
-        fit = pca.fit(X_data.toarray()) if issparse(X_data) else pca.fit(X_data)
-        X_pca = fit.transform(X_data.toarray()) if issparse(X_data) else fit.transform(X_data)
+        n_components = min(n_pca_components, X_data.shape[1] - 1)
+        if issparse(X_data):
+            # center implicitly instead of densifying the sparse expression matrix
+            fit, X_pca = _pca_fit_sparse(X_data, n_components, random_state=0)
+        else:
+            fit = PCA(n_components=n_components, svd_solver="arpack", random_state=0).fit(X_data)
+            X_pca = fit.transform(X_data)
         adata.obsm[pca_key] = X_pca
         adata.uns[pcs_key] = fit.components_.T
 
@@ -146,20 +146,16 @@ def lhsclassic(n_samples: int, n_dim: int, bounds=None, seed=19491001):
     u = np.random.rand(n_samples, n_dim)
     a = cut[:n_samples]
     b = cut[1 : n_samples + 1]
-    rdpoints = np.zeros(u.shape)
-    for j in range(n_dim):
-        rdpoints[:, j] = u[:, j] * (b - a) + a
+    rdpoints = u * (b - a)[:, None] + a[:, None]
 
     # Make the random pairings
-    H = np.zeros(rdpoints.shape)
-    for j in range(n_dim):
-        order = np.random.permutation(range(n_samples))
-        H[:, j] = rdpoints[order, j]
+    orders = np.argsort(np.random.rand(n_samples, n_dim), axis=0)
+    H = np.take_along_axis(rdpoints, orders, axis=0)
 
     # Scale according to bounds
     if bounds is not None:
-        for i in range(n_dim):
-            H[:, i] = H[:, i] * (bounds[i][1] - bounds[i][0]) + bounds[i][0]
+        bounds = np.asarray(bounds)
+        H = H * (bounds[:, 1] - bounds[:, 0]) + bounds[:, 0]
 
     return H
 
@@ -9,12 +9,14 @@ import pandas as pd
 import scipy.sparse as sp
 from anndata._core.anndata import AnnData
 from anndata._core.views import ArrayView
+from numba import jit
 from scipy import interpolate
 from scipy import sparse as sp
 from scipy import stats
 from scipy.integrate import odeint
 from scipy.linalg.blas import dgemm
 from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
 from scipy.spatial.distance import squareform as spsquare
 from sklearn.neighbors import NearestNeighbors
 from tqdm import tqdm
@@ -33,34 +35,43 @@ from ..dynamo_logger import (
 from ..preprocessing.utils import Freeman_Tukey
 from ..utils import areinstance, isarray
 
-
 # ---------------------------------------------------------------------------------------------------
 # others
+_MAPPER = {
+    "X_spliced": "M_s",
+    "X_unspliced": "M_u",
+    "X_new": "M_n",
+    "X_old": "M_o",
+    "X_total": "M_t",
+    "X_uu": "M_uu",
+    "X_ul": "M_ul",
+    "X_su": "M_su",
+    "X_sl": "M_sl",
+    "X_protein": "M_p",
+    "X": "X",
+}
+_MAPPER_UNSMOOTHED = {k: k for k in _MAPPER}
+_MAPPER_INVERSE = {v: k for k, v in _MAPPER.items()}
+_MAPPER_UNSMOOTHED_INVERSE = {v: k for k, v in _MAPPER_UNSMOOTHED.items()}
+
+
 def get_mapper(smoothed=True):
-    mapper = {
-        "X_spliced": "M_s" if smoothed else "X_spliced",
-        "X_unspliced": "M_u" if smoothed else "X_unspliced",
-        "X_new": "M_n" if smoothed else "X_new",
-        "X_old": "M_o" if smoothed else "X_old",
-        "X_total": "M_t" if smoothed else "X_total",
-        "X_uu": "M_uu" if smoothed else "X_uu",
-        "X_ul": "M_ul" if smoothed else "X_ul",
-        "X_su": "M_su" if smoothed else "X_su",
-        "X_sl": "M_sl" if smoothed else "X_sl",
-        "X_protein": "M_p" if smoothed else "X_protein",
-        "X": "X" if smoothed else "X",
-    }
-    return mapper
+    """Return the (shared, do not modify) mapping from raw layer names to their smoothed (moment) layer names."""
+    return _MAPPER if smoothed else _MAPPER_UNSMOOTHED
 
 
 def get_mapper_inverse(smoothed=True):
-    mapper = get_mapper(smoothed)
-
-    return dict([(v, k) for k, v in mapper.items()])
+    return _MAPPER_INVERSE if smoothed else _MAPPER_UNSMOOTHED_INVERSE
 
 
 def get_finite_inds(X, ax=0):
-    finite_inds = np.isfinite(X.sum(ax).A1) if sp.issparse(X) else np.isfinite(X.sum(ax))
+    if sp.issparse(X):
+        # only explicitly stored values can be non-finite; skip the reduction when there are none.
+        if np.isfinite(X.data).all():
+            return np.ones(X.shape[1 - ax], dtype=bool)
+        finite_inds = np.isfinite(X.sum(ax).A1)
+    else:
+        finite_inds = np.isfinite(X.sum(ax))
 
     return finite_inds
 
@@ -384,8 +395,7 @@ def flatten(arr):
 
 
 def closest_cell(coord, cells):
-    cells = np.asarray(cells)
-    dist_2 = np.sum((cells - coord) ** 2, axis=1)
+    dist_2 = cdist(np.atleast_2d(coord), np.asarray(cells), "sqeuclidean")
 
     return np.argmin(dist_2)
 
@@ -401,7 +411,15 @@ def elem_prod(X, Y):
 
 def norm(x, **kwargs):
     """calculate the norm of an array or matrix"""
-    if sp.issparse(x):
+    if sp.issparse(x) and x.format == "csr" and x.has_canonical_format and kwargs == {"axis": 1}:
+        # euclidean row norms as segmented sums over the stored values, skipping empty rows.
+        data = x.data if x.dtype.kind == "f" else x.data.astype(float)
+        sq, nonempty = data * data, np.diff(x.indptr) > 0
+        ret = np.zeros(x.shape[0], dtype=sq.dtype)
+        if sq.size > 0:
+            ret[nonempty] = np.add.reduceat(sq, x.indptr[:-1][nonempty])
+        return np.sqrt(ret)
+    elif sp.issparse(x):
         return sp.linalg.norm(x, **kwargs)
     else:
         return np.linalg.norm(x, **kwargs)
@@ -446,8 +464,9 @@ def einsum_correlation(X, Y_i, type="pearson"):
     for gene i"""
 
     if type == "pearson":
-        X -= X.mean(axis=1)[:, None]
-        Y_i -= np.nanmean(Y_i)
+        # center local copies so that the caller's arrays are left untouched
+        X = X - X.mean(axis=1, keepdims=True)
+        Y_i = Y_i - np.nanmean(Y_i)
     elif type == "cosine":
         X, Y_i = X, Y_i
     elif type == "spearman":
@@ -465,7 +484,7 @@ def einsum_correlation(X, Y_i, type="pearson"):
         if Y_norm == 0:
             corr = np.zeros(X_norm.shape[0])
         else:
-            corr = np.einsum("ij, j", X, Y_i) / (X_norm * Y_norm)[None, :]
+            corr = (X @ Y_i) / (X_norm * Y_norm)[None, :]
 
     return corr
 
@@ -476,15 +495,9 @@ def form_triu_matrix(arr):
     """
     n = int(np.ceil((np.sqrt(1 + 8 * len(arr)) - 1) * 0.5))
     M = np.zeros((n, n))
-    c = 0
-    for i in range(n):
-        for j in range(n):
-            if j >= i:
-                if c < len(arr):
-                    M[i, j] = arr[c]
-                    c += 1
-                else:
-                    break
+    iu = np.triu_indices(n)
+    k = min(len(arr), len(iu[0]))
+    M[iu[0][:k], iu[1][:k]] = np.asarray(arr)[:k]
     return M
 
 
@@ -773,22 +786,30 @@ def one_shot_gamma_alpha_matrix(k, t, U):
     """Assume U is a sparse matrix and only tested on one-shot experiment"""
     Kc = np.clip(k, 0, 1 - 1e-3)
     gamma = -(np.log(1 - Kc) / t)
-    alpha = U.multiply((gamma / k)[:, None])
+    if sp.issparse(U):
+        # scale the stored values row by row, keeping U's sparsity structure
+        alpha = U.tocsr(copy=True)
+        alpha.data = alpha.data * np.repeat(gamma / k, np.diff(alpha.indptr))
+    else:
+        alpha = U * (gamma / k)[:, None]
 
     return gamma, alpha
 
 
 def _one_shot_gamma_alpha_matrix(K, tau, N, R):
     """original code from Yan"""
-    N, R = N.A.T, R.A.T
+    N, R = N.A, R.A
     K = np.array(K)
     tau = tau[0]
     Kc = np.clip(K, 0, 1 - 1e-3)
     if np.isscalar(tau):
         B = -np.log(1 - Kc) / tau
+        B_ = B[:, None]
     else:
         B = -(np.log(1 - Kc)[None, :].T / tau).T
-    return B, (elem_prod(B, N) / K).T - elem_prod(B, R).T
+        B_ = B.T
+    # computed in the (genes x cells) layout of N and R
+    return B, N * (B_ / K[:, None]) - R * B_
 
 
 def compute_velocity_labeling_B(B, alpha, R):
@@ -817,7 +838,9 @@ def get_valid_bools(adata, filter_gene_mode):
 
 def log_unnormalized_data(raw, log_unnormalized):
     if sp.issparse(raw):
-        raw.data = np.log(raw.data + 1) if log_unnormalized else raw.data
+        # `raw` is usually a transposed view sharing its data buffer with an adata layer, don't log it in place.
+        raw = raw.copy() if log_unnormalized else raw
+        raw.data = np.log1p(raw.data) if log_unnormalized else raw.data
     else:
         raw = np.log1p(raw) if log_unnormalized else raw
 
@@ -885,17 +908,10 @@ def get_data_for_kin_params_estimation(
             False,
             "ss" if NTR_vel else "kinetic",
         )
-        raw, _ = subset_adata.layers["uu"].T, subset_adata.layers["uu"].T
-        U = log_unnormalized_data(raw, log_unnormalized)
-
-        raw, _ = subset_adata.layers["ul"].T, subset_adata.layers["ul"].T
-        Ul = log_unnormalized_data(raw, log_unnormalized)
-
-        raw, _ = subset_adata.layers["sl"].T, subset_adata.layers["sl"].T
-        Sl = log_unnormalized_data(raw, log_unnormalized)
-
-        raw, _ = subset_adata.layers["su"].T, subset_adata.layers["su"].T
-        S = log_unnormalized_data(raw, log_unnormalized)
+        U = log_unnormalized_data(subset_adata.layers["uu"].T, log_unnormalized)
+        Ul = log_unnormalized_data(subset_adata.layers["ul"].T, log_unnormalized)
+        Sl = log_unnormalized_data(subset_adata.layers["sl"].T, log_unnormalized)
+        S = log_unnormalized_data(subset_adata.layers["su"].T, log_unnormalized)
 
     # labeling without splicing
     if not has_splicing and (
@@ -915,19 +931,9 @@ def get_data_for_kin_params_estimation(
 
     elif not has_splicing and "new" in subset_adata.layers.keys():
         assumption_mRNA = ("ss" if NTR_vel else "kinetic",)
-        raw, _, old = (
-            subset_adata.layers["new"].T,
-            subset_adata.layers["new"].T,
-            subset_adata.layers["total"].T - subset_adata.layers["new"].T,
-        )
-        if sp.issparse(raw):
-            raw.data = np.log1p(raw.data) if log_unnormalized else raw.data
-            old.data = np.log1p(old.data) if log_unnormalized else old.data
-        else:
-            raw = np.log1p(raw) if log_unnormalized else raw
-            old = np.log1p(old) if log_unnormalized else old
-        U = old
-        Ul = raw
+        new = subset_adata.layers["new"].T
+        U = log_unnormalized_data(subset_adata.layers["total"].T - new, log_unnormalized)
+        Ul = log_unnormalized_data(new, log_unnormalized)
 
     # splicing data
     if not has_labeling and (
@@ -941,30 +947,14 @@ def get_data_for_kin_params_estimation(
         U = subset_adata.layers[mapper["X_unspliced"]].T if use_moments else subset_adata.layers["X_unspliced"].T
     elif not has_labeling and "unspliced" in subset_adata.layers.keys():
         assumption_mRNA = "kinetic" if tkey in subset_adata.obs.columns else "ss"
-        raw, _ = (
-            subset_adata.layers["unspliced"].T,
-            subset_adata.layers["unspliced"].T,
-        )
-        if sp.issparse(raw):
-            raw.data = np.log1p(raw.data) if log_unnormalized else raw.data
-        else:
-            raw = np.log1p(raw) if log_unnormalized else raw
-        U = raw
+        U = log_unnormalized_data(subset_adata.layers["unspliced"].T, log_unnormalized)
     if not has_labeling and (
         ("X_spliced" in subset_adata.layers.keys() and not use_moments)
         or (mapper["X_spliced"] in subset_adata.layers.keys() and use_moments)
     ):
         S = subset_adata.layers[mapper["X_spliced"]].T if use_moments else subset_adata.layers["X_spliced"].T
     elif not has_labeling and "spliced" in subset_adata.layers.keys():
-        raw, _ = (
-            subset_adata.layers["spliced"].T,
-            subset_adata.layers["spliced"].T,
-        )
-        if sp.issparse(raw):
-            raw.data = np.log1p(raw.data) if log_unnormalized else raw.data
-        else:
-            raw = np.log1p(raw) if log_unnormalized else raw
-        S = raw
+        S = log_unnormalized_data(subset_adata.layers["spliced"].T, log_unnormalized)
 
     # protein
     ind_for_proteins = None
@@ -1028,6 +1018,17 @@ def get_data_for_kin_params_estimation(
     )
 
 
+def _scatter_gene_cell_block(layer, block, rows, cols):
+    """Add the (genes x cells) `block` (velocities, cell-wise rates) of one group onto the sparse `layer` at
+    (`rows`, `cols`).
+
+    Groups cover disjoint cells, so adding the group's COO triplets is equivalent to (and much cheaper than) assigning
+    into a slice of the compressed matrix.
+    """
+    block = sp.coo_matrix(block.T, dtype=np.float64)
+    return layer + sp.csr_matrix((block.data, (rows[block.row], cols[block.col])), shape=layer.shape)
+
+
 def set_velocity(
     adata,
     vel_U,
@@ -1041,40 +1042,42 @@ def set_velocity(
     valid_ind,
     ind_for_proteins,
 ):
-    cur_cells_ind, valid_ind_ = (
-        np.where(cur_cells_bools)[0][:, np.newaxis],
-        np.where(valid_ind)[0],
-    )
-    if type(vel_U) is not float:
-        if cur_grp == _group[0]:
-            adata.layers["velocity_U"] = sp.csr_matrix((adata.shape), dtype=np.float64)
-        vel_U = vel_U.T.tocsr() if sp.issparse(vel_U) else sp.csr_matrix(vel_U, dtype=np.float64).T
-        adata.layers["velocity_U"][cur_cells_ind, valid_ind_] = vel_U
-    if type(vel_S) is not float:
-        if cur_grp == _group[0]:
-            adata.layers["velocity_S"] = sp.csr_matrix((adata.shape), dtype=np.float64)
-        vel_S = vel_S.T.tocsr() if sp.issparse(vel_S) else sp.csr_matrix(vel_S, dtype=np.float64).T
-        adata.layers["velocity_S"][cur_cells_ind, valid_ind_] = vel_S
-    if type(vel_N) is not float:
-        if cur_grp == _group[0]:
-            adata.layers["velocity_N"] = sp.csr_matrix((adata.shape), dtype=np.float64)
-        vel_N = vel_N.T.tocsr() if sp.issparse(vel_N) else sp.csr_matrix(vel_N, dtype=np.float64).T
-        adata.layers["velocity_N"][cur_cells_ind, valid_ind_] = vel_N
-    if type(vel_T) is not float:
-        if cur_grp == _group[0]:
-            adata.layers["velocity_T"] = sp.csr_matrix((adata.shape), dtype=np.float64)
-        vel_T = vel_T.T.tocsr() if sp.issparse(vel_T) else sp.csr_matrix(vel_T, dtype=np.float64).T
-        adata.layers["velocity_T"][cur_cells_ind, valid_ind_] = vel_T
+    cur_cells_ind, valid_ind_ = np.flatnonzero(cur_cells_bools), np.flatnonzero(valid_ind)
+    for key, vel in zip(
+        ["velocity_U", "velocity_S", "velocity_N", "velocity_T"],
+        [vel_U, vel_S, vel_N, vel_T],
+    ):
+        if type(vel) is not float:
+            if cur_grp == _group[0]:
+                adata.layers[key] = sp.csr_matrix((adata.shape), dtype=np.float64)
+            adata.layers[key] = _scatter_gene_cell_block(adata.layers[key], vel, cur_cells_ind, valid_ind_)
     if type(vel_P) is not float:
         if cur_grp == _group[0]:
             adata.obsm["velocity_P"] = sp.csr_matrix((adata.obsm["P"].shape[0], len(ind_for_proteins)), dtype=float)
-        adata.obsm["velocity_P"][cur_cells_bools, :] = (
-            vel_P.T.tocsr() if sp.issparse(vel_P) else sp.csr_matrix(vel_P, dtype=float).T
+        adata.obsm["velocity_P"] = _scatter_gene_cell_block(
+            adata.obsm["velocity_P"], vel_P, cur_cells_ind, np.arange(len(ind_for_proteins))
         )
 
     return adata
 
 
+def _set_var_params(adata, valid_ind, params):
+    """Write the per-gene parameters in `params` ({column: values}) to the `valid_ind` rows of adata.var at once."""
+    index, batch = adata.var.index[valid_ind], {}
+    for key, val in params.items():
+        if val is not None:
+            batch[key] = val
+            continue
+        # parameters that were not estimated (None) are written on their own to keep pandas' coercion of None, after
+        # the preceding ones so that new columns are created in the order of `params`.
+        if len(batch) > 0:
+            adata.var.loc[valid_ind, list(batch)] = pd.DataFrame(batch, index=index)
+            batch = {}
+        adata.var.loc[valid_ind, key] = None
+    if len(batch) > 0:
+        adata.var.loc[valid_ind, list(batch)] = pd.DataFrame(batch, index=index)
+
+
 def set_param_ss(
     adata,
     est,
@@ -1111,12 +1114,18 @@ def set_param_ss(
                 adata.var[kin_param_pre + "half_life"],
             ) = (None, None, None)
 
-        adata.var.loc[valid_ind, kin_param_pre + "beta"] = beta
-        adata.var.loc[valid_ind, kin_param_pre + "gamma"] = gamma
-        adata.var.loc[valid_ind, kin_param_pre + "half_life"] = np.log(2) / gamma
+        _set_var_params(
+            adata,
+            valid_ind,
+            {
+                kin_param_pre + "beta": beta,
+                kin_param_pre + "gamma": gamma,
+                kin_param_pre + "half_life": np.log(2) / gamma,
+            },
+        )
     else:
         if alpha is not None:
-            if len(alpha.shape) > 1:  # for each cell
+            if alpha.ndim > 1:  # for each cell
                 if cur_grp == _group[0]:
                     adata.varm[kin_param_pre + "alpha"] = (
                         sp.csr_matrix(np.zeros(adata.shape[::-1]))
@@ -1125,7 +1134,7 @@ def set_param_ss(
                     )  #
                 adata.varm[kin_param_pre + "alpha"][valid_ind, :] = alpha  #
                 adata.var.loc[valid_ind, kin_param_pre + "alpha"] = alpha.mean(1)
-            elif len(alpha.shape) == 1:
+            elif alpha.ndim == 1:
                 if cur_grp == _group[0]:
                     adata.var[kin_param_pre + "alpha"] = None
                 adata.var.loc[valid_ind, kin_param_pre + "alpha"] = alpha
@@ -1136,9 +1145,6 @@ def set_param_ss(
                 adata.var[kin_param_pre + "gamma"],
                 adata.var[kin_param_pre + "half_life"],
             ) = (None, None, None)
-        adata.var.loc[valid_ind, kin_param_pre + "beta"] = beta
-        adata.var.loc[valid_ind, kin_param_pre + "gamma"] = gamma
-        adata.var.loc[valid_ind, kin_param_pre + "half_life"] = None if gamma is None else np.log(2) / gamma
 
         (
             alpha_intercept,
@@ -1199,25 +1205,31 @@ def set_param_ss(
                 None,
             )
 
-        adata.var.loc[valid_ind, kin_param_pre + "alpha_b"] = alpha_intercept
-        adata.var.loc[valid_ind, kin_param_pre + "alpha_r2"] = alpha_r2
-
         if gamma_r2 is not None:
             gamma_r2[~np.isfinite(gamma_r2)] = 0
-        adata.var.loc[valid_ind, kin_param_pre + "gamma_b"] = gamma_intercept
-        adata.var.loc[valid_ind, kin_param_pre + "gamma_r2"] = gamma_r2
-        adata.var.loc[valid_ind, kin_param_pre + "gamma_logLL"] = gamma_logLL
-
-        adata.var.loc[valid_ind, kin_param_pre + "bs"] = bs
-        adata.var.loc[valid_ind, kin_param_pre + "bf"] = bf
-
-        adata.var.loc[valid_ind, kin_param_pre + "uu0"] = uu0
-        adata.var.loc[valid_ind, kin_param_pre + "ul0"] = ul0
-        adata.var.loc[valid_ind, kin_param_pre + "su0"] = su0
-        adata.var.loc[valid_ind, kin_param_pre + "sl0"] = sl0
-        adata.var.loc[valid_ind, kin_param_pre + "U0"] = U0
-        adata.var.loc[valid_ind, kin_param_pre + "S0"] = S0
-        adata.var.loc[valid_ind, kin_param_pre + "total0"] = total0
+        _set_var_params(
+            adata,
+            valid_ind,
+            {
+                kin_param_pre + "beta": beta,
+                kin_param_pre + "gamma": gamma,
+                kin_param_pre + "half_life": None if gamma is None else np.log(2) / gamma,
+                kin_param_pre + "alpha_b": alpha_intercept,
+                kin_param_pre + "alpha_r2": alpha_r2,
+                kin_param_pre + "gamma_b": gamma_intercept,
+                kin_param_pre + "gamma_r2": gamma_r2,
+                kin_param_pre + "gamma_logLL": gamma_logLL,
+                kin_param_pre + "bs": bs,
+                kin_param_pre + "bf": bf,
+                kin_param_pre + "uu0": uu0,
+                kin_param_pre + "ul0": ul0,
+                kin_param_pre + "su0": su0,
+                kin_param_pre + "sl0": sl0,
+                kin_param_pre + "U0": U0,
+                kin_param_pre + "S0": S0,
+                kin_param_pre + "total0": total0,
+            },
+        )
 
         if experiment_type == "one-shot":
             adata.var[kin_param_pre + "beta_k"] = None
@@ -1279,25 +1291,29 @@ def set_param_kinetic(
 
     if isarray(alpha) and alpha.ndim > 1:
         adata.var.loc[valid_ind, kin_param_pre + "alpha"] = alpha.mean(1)
-        cur_cells_ind, valid_ind_ = (
-            np.where(cur_cells_bools)[0][:, np.newaxis],
-            np.where(valid_ind)[0],
-        )
+        cur_cells_ind, valid_ind_ = np.flatnonzero(cur_cells_bools), np.flatnonzero(valid_ind)
         if cur_grp == _group[0]:
             adata.layers["cell_wise_alpha"] = sp.csr_matrix((adata.shape), dtype=np.float64)
-        alpha = alpha.T.tocsr() if sp.issparse(alpha) else sp.csr_matrix(alpha, dtype=np.float64).T
-        adata.layers["cell_wise_alpha"][cur_cells_ind, valid_ind_] = alpha
+        adata.layers["cell_wise_alpha"] = _scatter_gene_cell_block(
+            adata.layers["cell_wise_alpha"], alpha, cur_cells_ind, valid_ind_
+        )
     else:
         adata.var.loc[valid_ind, kin_param_pre + "alpha"] = alpha
-    adata.var.loc[valid_ind, kin_param_pre + "a"] = a
-    adata.var.loc[valid_ind, kin_param_pre + "b"] = b
-    adata.var.loc[valid_ind, kin_param_pre + "alpha_a"] = alpha_a
-    adata.var.loc[valid_ind, kin_param_pre + "alpha_i"] = alpha_i
-    adata.var.loc[valid_ind, kin_param_pre + "beta"] = beta
-    adata.var.loc[valid_ind, kin_param_pre + "gamma"] = gamma
-    adata.var.loc[valid_ind, kin_param_pre + "half_life"] = np.log(2) / gamma
-    adata.var.loc[valid_ind, kin_param_pre + "cost"] = cost
-    adata.var.loc[valid_ind, kin_param_pre + "logLL"] = logLL
+    _set_var_params(
+        adata,
+        valid_ind,
+        {
+            kin_param_pre + "a": a,
+            kin_param_pre + "b": b,
+            kin_param_pre + "alpha_a": alpha_a,
+            kin_param_pre + "alpha_i": alpha_i,
+            kin_param_pre + "beta": beta,
+            kin_param_pre + "gamma": gamma,
+            kin_param_pre + "half_life": np.log(2) / gamma,
+            kin_param_pre + "cost": cost,
+            kin_param_pre + "logLL": logLL,
+        },
+    )
     # add extra parameters (u0, uu0, etc.)
     extra_params.columns = [kin_param_pre + i for i in extra_params.columns]
     extra_params = extra_params.set_index(adata.var.index[valid_ind])
@@ -1340,24 +1356,7 @@ def get_U_S_for_velocity_estimation(subset_adata, use_moments, has_splicing, has
                     subset_adata.layers["new"].T,
                     subset_adata.layers["total"].T,
                 )
-                if sp.issparse(U):
-                    U.data, S.data = (
-                        np.log1p(U.data) if log_unnormalized else U.data,
-                        np.log1p(S.data) if log_unnormalized else S.data,
-                    )
-                    N.data, T.data = (
-                        np.log1p(N.data) if log_unnormalized else N.data,
-                        np.log1p(T.data) if log_unnormalized else T.data,
-                    )
-                else:
-                    U, S = (
-                        np.log1p(U) if log_unnormalized else U,
-                        np.log1p(S) if log_unnormalized else S,
-                    )
-                    N, T = (
-                        np.log1p(N) if log_unnormalized else N,
-                        np.log1p(T) if log_unnormalized else T,
-                    )
+                U, S, N, T = (log_unnormalized_data(x, log_unnormalized) for x in (U, S, N, T))
             U, S = (N, T) if NTR else (U, S)
         else:
             if ("X_unspliced" in subset_adata.layers.keys()) or (
@@ -1378,12 +1377,7 @@ def get_U_S_for_velocity_estimation(subset_adata, use_moments, has_splicing, has
                     subset_adata.layers["unspliced"].T,
                     subset_adata.layers["spliced"].T,
                 )
-                if sp.issparse(U):
-                    U.data = np.log1p(U.data) if log_unnormalized else U.data
-                    S.data = np.log1p(S.data) if log_unnormalized else S.data
-                else:
-                    U = np.log1p(U) if log_unnormalized else U
-                    S = np.log1p(S) if log_unnormalized else S
+                U, S = log_unnormalized_data(U, log_unnormalized), log_unnormalized_data(S, log_unnormalized)
     else:
         if ("X_new" in subset_adata.layers.keys()) or (
             mapper["X_new"] in subset_adata.layers.keys()
@@ -1411,12 +1405,7 @@ def get_U_S_for_velocity_estimation(subset_adata, use_moments, has_splicing, has
                 # if NTR
                 # else subset_adata.layers["total"].T - subset_adata.layers["new"].T
             )
-            if sp.issparse(U):
-                U.data = np.log1p(U.data) if log_unnormalized else U.data
-                S.data = np.log1p(S.data) if log_unnormalized else S.data
-            else:
-                U = np.log1p(U) if log_unnormalized else U
-                S = np.log1p(S) if log_unnormalized else S
+            U, S = log_unnormalized_data(U, log_unnormalized), log_unnormalized_data(S, log_unnormalized)
 
     return U, S
 
@@ -1641,9 +1630,11 @@ def calc_norm_loglikelihood(X, Y, k, f=lambda X, k: np.einsum("ij,i -> ij", X, k
     d = F - Y
     sig = np.einsum("ij,ij -> i", d, d)
 
-    LogLL = 0
-    for i in range(Y.shape[0]):
-        LogLL += norm_loglikelihood(Y[i], F[i], np.sqrt(sig[i] / n))
+    # closed form of summing norm_loglikelihood(Y[i], F[i], np.sqrt(sig[i] / n)) over rows: the squared standardized
+    # error of row i is sig[i] / (sig[i] / n), i.e. n (or nan for a perfect fit, as in the per-row evaluation).
+    with np.errstate(divide="ignore", invalid="ignore"):
+        err_sq = sig / (sig / n)
+        LogLL = np.sum(-Y.shape[1] / 2 * np.log(2 * np.pi) - 0.5 * np.log(sig / n) - 0.5 * err_sq)
 
     return LogLL
 
@@ -1721,97 +1712,34 @@ def set_transition_genes(
         min_delta = 0.01
 
     # the following parameters aggreation for different groups can be improved later
-    if layer == "U":
-        if "alpha" not in adata.var.columns:
-            is_group_alpha, is_group_alpha_r2 = (
-                get_group_params_indices(adata, "alpha"),
-                get_group_params_indices(adata, "alpha_r2"),
-            )
-            if is_group_alpha.sum() > 0:
-                adata.var["alpha"] = adata.var.loc[:, is_group_alpha].mean(1, skipna=True)
-                adata.var["alpha_r2"] = adata.var.loc[:, np.hstack((is_group_alpha_r2, False))].mean(1, skipna=True)
-            else:
-                raise Exception("there is no alpha/alpha_r2 parameter estimated for your adata object")
-
-        if "alpha_r2" not in adata.var.columns:
-            adata.var["alpha_r2"] = None
-        if np.all(adata.var.alpha_r2.values is None):
-            adata.var.alpha_r2 = 1
-        adata.var[store_key] = (
-            (adata.var.alpha > min_alpha) & (adata.var.alpha_r2 > min_r2) & adata.var.use_for_dynamics
-            if use_for_dynamics
-            else (adata.var.alpha > min_alpha) & (adata.var.alpha_r2 > min_r2)
-        )
-    elif layer == "S":
-        if "gamma" not in adata.var.columns:
-            is_group_gamma, is_group_gamma_r2 = (
-                get_group_params_indices(adata, "gamma"),
-                get_group_params_indices(adata, "gamma_r2"),
+    layer_params = {
+        "U": ("alpha", min_alpha),
+        "S": ("gamma", min_gamma),
+        "P": ("delta", min_delta),
+        "T": ("gamma", min_gamma),
+    }
+    if layer in layer_params:
+        param, min_param = layer_params[layer]
+        param_r2 = param + "_r2"
+        if param not in adata.var.columns:
+            is_group_param, is_group_param_r2 = (
+                get_group_params_indices(adata, param),
+                get_group_params_indices(adata, param_r2),
             )
-            if is_group_gamma.sum() > 0:
-                adata.var["gamma"] = adata.var.loc[:, is_group_gamma].mean(1, skipna=True)
-                adata.var["gamma_r2"] = adata.var.loc[:, np.hstack((is_group_gamma_r2, False))].mean(1, skipna=True)
+            if is_group_param.sum() > 0:
+                adata.var[param] = adata.var.loc[:, is_group_param].mean(1, skipna=True)
+                adata.var[param_r2] = adata.var.loc[:, np.hstack((is_group_param_r2, False))].mean(1, skipna=True)
             else:
-                raise Exception("there is no gamma/gamma_r2 parameter estimated for your adata object")
+                raise Exception(f"there is no {param}/{param_r2} parameter estimated for your adata object")
 
-        if "gamma_r2" not in adata.var.columns:
-            main_debug("setting all gamma_r2 to 1")
-            adata.var["gamma_r2"] = 1
-        if np.all(adata.var.gamma_r2.values is None) or np.all(adata.var.gamma_r2.values == ""):
-            main_debug("Since all adata.var.gamma_r2 values are None or '', setting all gamma_r2 values to 1.")
-            adata.var.gamma_r2 = 1
+        if param_r2 not in adata.var.columns or adata.var[param_r2].isna().all() or (adata.var[param_r2] == "").all():
+            main_debug(f"{param_r2} is not estimated, setting all {param_r2} values to 1.")
+            adata.var[param_r2] = 1
 
-        adata.var[store_key] = (adata.var.gamma > min_gamma) & (adata.var.gamma_r2 > min_r2)
+        adata.var[store_key] = (adata.var[param] > min_param) & (adata.var[param_r2] > min_r2)
         if use_for_dynamics:
             adata.var[store_key] = adata.var[store_key] & adata.var.use_for_dynamics
 
-    elif layer == "P":
-        if "delta" not in adata.var.columns:
-            is_group_delta, is_group_delta_r2 = (
-                get_group_params_indices(adata, "delta"),
-                get_group_params_indices(adata, "delta_r2"),
-            )
-            if is_group_delta.sum() > 0:
-                adata.var["delta"] = adata.var.loc[:, is_group_delta].mean(1, skipna=True)
-                adata.var["delta_r2"] = adata.var.loc[:, np.hstack((is_group_delta_r2, False))].mean(1, skipna=True)
-            else:
-                raise Exception("there is no delta/delta_r2 parameter estimated for your adata object")
-
-        if "delta_r2" not in adata.var.columns:
-            adata.var["delta_r2"] = None
-        if np.all(adata.var.delta_r2.values is None):
-            adata.var.delta_r2 = 1
-        adata.var[store_key] = (
-            (adata.var.delta > min_delta) & (adata.var.delta_r2 > min_r2) & adata.var.use_for_dynamics
-            if use_for_dynamics
-            else (adata.var.delta > min_delta) & (adata.var.delta_r2 > min_r2)
-        )
-    if layer == "T":
-        if "gamma" not in adata.var.columns:
-            is_group_gamma, is_group_gamma_r2 = (
-                get_group_params_indices(adata, "gamma"),
-                get_group_params_indices(adata, "gamma_r2"),
-            )
-            if is_group_gamma.sum() > 0:
-                adata.var["gamma"] = adata.var.loc[:, is_group_gamma].mean(1, skipna=True)
-                adata.var["gamma_r2"] = adata.var.loc[:, np.hstack((is_group_gamma_r2, False))].mean(1, skipna=True)
-            else:
-                raise Exception("there is no gamma/gamma_r2 parameter estimated for your adata object")
-
-        if "gamma_r2" not in adata.var.columns:
-            adata.var["gamma_r2"] = None
-        if np.all(adata.var.gamma_r2.values is None):
-            adata.var.gamma_r2 = 1
-        if sum(adata.var.gamma_r2.isna()) == adata.n_vars:
-            gamm_r2_checker = adata.var.gamma_r2.isna()
-        else:
-            gamm_r2_checker = adata.var.gamma_r2 > min_r2
-        adata.var[store_key] = (
-            (adata.var.gamma > min_gamma) & gamm_r2_checker & adata.var.use_for_dynamics
-            if use_for_dynamics
-            else (adata.var.gamma > min_gamma) & gamm_r2_checker
-        )
-
     if adata.var[store_key].sum() < 5 and adata.n_vars > 5:
         main_warning(
             "Only less than 5 genes satisfies transition gene selection criteria, which may be resulted "
@@ -1826,6 +1754,11 @@ def set_transition_genes(
     return adata
 
 
+_SPLICING_LABELING_EXPERIMENTS = {"kin", "mix_pulse_chase", "mix_kin_deg", "deg", "one_shot", "one-shot", "mix_std_stm"}
+_LABELING_EXPERIMENTS = {"kin", "deg", "one-shot", "one_shot", "mix_std_stm"}
+_LAYER_VELOCITY_KEY = {"X_total": "velocity_T", "X_spliced": "velocity_S"}
+
+
 def get_ekey_vkey_from_adata(adata):
     """
     ekey: expression from which to extrapolate velocity
@@ -1833,152 +1766,125 @@ def get_ekey_vkey_from_adata(adata):
     layer: the states cells will be used in velocity embedding.
     """
     dynamics_key = [i for i in adata.uns.keys() if i.endswith("dynamics")][0]
-    experiment_type, use_smoothed = (
-        adata.uns[dynamics_key]["experiment_type"],
-        adata.uns[dynamics_key]["use_smoothed"],
+    dynamics = adata.uns[dynamics_key]
+    experiment_type, use_smoothed, has_splicing, has_labeling, NTR = (
+        dynamics["experiment_type"],
+        dynamics["use_smoothed"],
+        dynamics["has_splicing"],
+        dynamics["has_labeling"],
+        dynamics["NTR_vel"],
     )
-    has_splicing, has_labeling = (
-        adata.uns[dynamics_key]["has_splicing"],
-        adata.uns[dynamics_key]["has_labeling"],
-    )
-    NTR = adata.uns[dynamics_key]["NTR_vel"]
-
-    mapper = get_mapper()
-    layer = []
+    layers = adata.layers.keys()
 
     if has_splicing:
         if has_labeling:
-            if "X_new" not in adata.layers.keys():  # unlabel spliced: S
+            if "X_new" not in layers:  # unlabel spliced: S
                 raise Exception("The input data you have is not normalized or normalized + smoothed!")
-
-            if experiment_type.lower() in [
-                "kin",
-                "mix_pulse_chase",
-                "mix_kin_deg",
-            ]:
-                ekey, vkey, layer = (
-                    (
-                        mapper["X_total"] if NTR else mapper["X_spliced"],
-                        "velocity_T" if NTR else "velocity_S",
-                        ("X_total" if NTR else "X_spliced"),
-                    )
-                    if use_smoothed
-                    else (
-                        "X_total" if NTR else "X_spliced",
-                        "velocity_T" if NTR else "velocity_S",
-                        "X_total" if NTR else "X_spliced",
-                    )
-                )
-            elif experiment_type.lower() == "deg":
-                ekey, vkey, layer = (
-                    (
-                        mapper["X_total"] if NTR else mapper["X_spliced"],
-                        "velocity_T" if NTR else "velocity_S",
-                        ("X_total" if NTR else "X_spliced"),
-                    )
-                    if use_smoothed
-                    else (
-                        "X_total" if NTR else "X_spliced",
-                        "velocity_T" if NTR else "velocity_S",
-                        "X_total" if NTR else "X_spliced",
-                    )
-                )
-            elif experiment_type.lower() in ["one_shot", "one-shot"]:
-                ekey, vkey, layer = (
-                    (
-                        mapper["X_total"] if NTR else mapper["X_spliced"],
-                        "velocity_T" if NTR else "velocity_S",
-                        ("X_total" if NTR else "X_spliced"),
-                    )
-                    if use_smoothed
-                    else (
-                        "X_total" if NTR else "X_spliced",
-                        "velocity_T" if NTR else "velocity_S",
-                        "X_total" if NTR else "X_spliced",
-                    )
-                )
-            elif experiment_type.lower() == "mix_std_stm":
-                ekey, vkey, layer = (
-                    (
-                        mapper["X_total"] if NTR else mapper["X_spliced"],
-                        "velocity_T" if NTR else "velocity_S",
-                        ("X_total" if NTR else "X_spliced"),
-                    )
-                    if use_smoothed
-                    else (
-                        "X_total" if NTR else "X_spliced",
-                        "velocity_T" if NTR else "velocity_S",
-                        "X_total" if NTR else "X_spliced",
-                    )
-                )
+            valid_experiment = experiment_type.lower() in _SPLICING_LABELING_EXPERIMENTS
+            layer = "X_total" if NTR else "X_spliced"
         else:
-            if not (("X_unspliced" in adata.layers.keys()) or (mapper["X_unspliced"] in adata.layers.keys())):
+            if not (("X_unspliced" in layers) or (_MAPPER["X_unspliced"] in layers)):
                 raise Exception(
                     "The input data you have is not normalized/log transformed or smoothed and normalized/log "
                     "transformed!"
                 )
-            ekey, vkey, layer = (
-                (mapper["X_spliced"], "velocity_S", "X_spliced")
-                if use_smoothed
-                else ("X_spliced", "velocity_S", "X_spliced")
-            )
+            valid_experiment, layer = True, "X_spliced"
     else:
-        # use_smoothed: False
-        if ("X_new" in adata.layers.keys()) or (mapper["X_new"] in adata.layers.keys):  # run new / total ratio (NTR)
-            # we may also create M_U, M_S layers?
-            if experiment_type == "kin":
-                ekey, vkey, layer = (
-                    (mapper["X_total"], "velocity_T", "X_total")
-                    if use_smoothed
-                    else ("X_total", "velocity_T", "X_total")
-                )
-            elif experiment_type == "deg":
-                ekey, vkey, layer = (
-                    (mapper["X_total"], "velocity_T", "X_total")
-                    if use_smoothed
-                    else ("X_total", "velocity_T", "X_total")
-                )
-            elif experiment_type in ["one-shot", "one_shot"]:
-                ekey, vkey, layer = (
-                    (mapper["X_total"], "velocity_T", "X_total")
-                    if use_smoothed
-                    else ("X_total", "velocity_T", "X_total")
-                )
-            elif experiment_type == "mix_std_stm":
-                ekey, vkey, layer = (
-                    (mapper["X_total"], "velocity_T", "X_total")
-                    if use_smoothed
-                    else ("X_total", "velocity_T", "X_total")
-                )
-
-        else:
+        if not (("X_new" in layers) or (_MAPPER["X_new"] in layers)):  # run new / total ratio (NTR)
             raise Exception(
                 "The input data you have is not normalized/log trnasformed or smoothed and normalized/log trnasformed!"
             )
+        valid_experiment, layer = experiment_type in _LABELING_EXPERIMENTS, "X_total"
+
+    if not valid_experiment:
+        raise ValueError(f"Can not determine the velocity key for the experiment type {experiment_type}.")
+
+    ekey, vkey = (_MAPPER[layer] if use_smoothed else layer), _LAYER_VELOCITY_KEY[layer]
 
     return ekey, vkey, layer
 
 
 # ---------------------------------------------------------------------------------------------------
 # cell velocities related
+@jit(nopython=True)
+def _iterative_neighbor_indices(adjacency_list, source_idx, n_order_neighbors):
+    """Breadth-first search over the kNN index array `adjacency_list` from `source_idx`; returns the sorted indices of
+    the cells reached within `n_order_neighbors` steps (including `source_idx`)."""
+    n = adjacency_list.shape[0]
+    seen = np.zeros(n, dtype=np.bool_)
+    visited = np.empty(n, dtype=np.int64)
+    seen[source_idx], visited[0] = True, source_idx
+    start, end = 0, 1
+    for _ in range(n_order_neighbors):
+        frontier_end = end
+        for i in range(start, frontier_end):
+            for j in adjacency_list[visited[i]]:
+                if not seen[j]:
+                    seen[j] = True
+                    visited[end] = j
+                    end += 1
+        start = frontier_end
+        if start == end:
+            break
+    return np.sort(visited[:end])
+
+
 def get_neighbor_indices(adjacency_list, source_idx, n_order_neighbors=2, max_neighbors_num=None):
     """returns a list (np.array) of `n_order_neighbors` neighbor indices of source_idx. If `max_neighbors_num` is set and the n order neighbors of `source_idx` is larger than `max_neighbors_num`, a list of neighbors will be randomly chosen and returned."""
-    _indices = [source_idx]
-    for _ in range(n_order_neighbors):
-        _indices = np.append(_indices, adjacency_list[_indices])
-        if np.isnan(_indices).any():
-            _indices = _indices[~np.isnan(_indices)]
-    _indices = np.unique(_indices)
+    if isinstance(adjacency_list, np.ndarray) and np.issubdtype(adjacency_list.dtype, np.integer):
+        _indices = _iterative_neighbor_indices(adjacency_list, source_idx, n_order_neighbors)
+    else:
+        # nan-padded float neighbor lists: drop the padding and go back to integers after each hop
+        _indices = np.array([source_idx])
+        for _ in range(n_order_neighbors):
+            _indices = np.append(_indices, adjacency_list[_indices])
+            _indices = _indices[~np.isnan(_indices)].astype(int)
+        _indices = np.unique(_indices)
     if max_neighbors_num is not None and len(_indices) > max_neighbors_num:
         _indices = np.random.choice(_indices, max_neighbors_num, replace=False)
     return _indices
 
 
 def append_iterative_neighbor_indices(indices, n_recurse_neighbors=2, max_neighbors_num=None):
-    indices_rec = []
-    for i in range(indices.shape[0]):
-        neig = get_neighbor_indices(indices, i, n_recurse_neighbors, max_neighbors_num)
-        indices_rec.append(neig)
+    if isinstance(indices, np.ndarray) and indices.ndim == 2 and np.issubdtype(indices.dtype, np.integer):
+        if indices.size > 0 and indices.max() >= indices.shape[0]:
+            raise ValueError(f"Neighbor indices must be smaller than the number of cells ({indices.shape[0]}).")
+        if indices.size > 0 and indices.min() < 0:
+            # negative entries (e.g. the -1 padding of pynndescent) mark missing neighbors, which are dropped by the
+            # nan-aware per-row fallback below
+            indices = np.where(indices < 0, np.nan, indices)
+    if isinstance(indices, np.ndarray) and np.issubdtype(indices.dtype, np.floating) and not np.isnan(indices).any():
+        # float neighbor indices without nan padding are converted once so that they take the integer path below
+        indices = indices.astype(np.int64)
+    if not (isinstance(indices, np.ndarray) and indices.ndim == 2 and np.issubdtype(indices.dtype, np.integer)):
+        # ragged or nan-padded neighbor lists
+        return [
+            get_neighbor_indices(indices, i, n_recurse_neighbors, max_neighbors_num) for i in range(indices.shape[0])
+        ]
+
+    # cells reachable within `n_recurse_neighbors` steps (including the cell itself) are the nonzero entries in the
+    # rows of (I + A)^n_recurse_neighbors, where A is the kNN adjacency matrix.
+    n, k = indices.shape
+    idx_dtype = np.int32 if indices.size < np.iinfo(np.int32).max else np.int64
+    step = sp.csr_matrix(
+        (
+            np.ones(indices.size, dtype=bool),
+            np.ascontiguousarray(indices.ravel(), dtype=idx_dtype),
+            np.arange(0, indices.size + 1, k, dtype=idx_dtype),
+        ),
+        shape=(n, n),
+    )
+    step = step + sp.identity(n, dtype=bool, format="csr")
+    reach = sp.identity(n, dtype=bool, format="csr")
+    for _ in range(n_recurse_neighbors):
+        reach = reach @ step
+    reach.sort_indices()
+
+    indices_rec = np.split(reach.indices, reach.indptr[1:-1])
+    if max_neighbors_num is not None:
+        for i, neig in enumerate(indices_rec):
+            if len(neig) > max_neighbors_num:
+                indices_rec[i] = np.random.choice(neig, max_neighbors_num, replace=False)
     return indices_rec
 
 
@@ -1986,20 +1892,19 @@ def split_velocity_graph(G, neg_cells_trick=True):
     """split velocity graph (built either with correlation or with cosine kernel
     into one positive graph and one negative graph"""
 
-    if not sp.issparse(G):
-        G = sp.csr_matrix(G)
-    if neg_cells_trick:
-        G_ = G.copy()
-    G.data[G.data < 0] = 0
-    G.eliminate_zeros()
+    G = sp.csr_matrix(G)
 
-    if neg_cells_trick:
-        G_.data[G_.data > 0] = 0
-        G_.eliminate_zeros()
+    def select(mask):
+        # keep the stored entries in `mask`; row pointers follow from the running count of kept entries.
+        indptr = np.concatenate(([0], np.cumsum(mask)))[G.indptr]
+        return sp.csr_matrix((G.data[mask], G.indices[mask], indptr), shape=G.shape)
 
-        return (G, G_)
+    # zeros are dropped from both graphs, nans are kept in both (as eliminate_zeros does)
+    G_pos = select(~(G.data <= 0))
+    if neg_cells_trick:
+        return (G_pos, select(~(G.data >= 0)))
     else:
-        return G
+        return G_pos
 
 
 # ---------------------------------------------------------------------------------------------------
@@ -2084,21 +1989,11 @@ def integrate_vf(
 ):
     """integrating along vector field function"""
 
-    n_cell, n_feature, n_steps = (
-        init_states.shape[0],
-        init_states.shape[1],
-        len(t) if interpolation_num is None else interpolation_num,
-    )
+    n_cell, n_feature = init_states.shape
 
-    if n_cell > 1:
-        if integration_direction == "both":
-            if average:
-                avg = np.zeros((n_steps * 2, n_feature))
-        else:
-            if average:
-                avg = np.zeros((n_steps, n_feature))
-
-    Y = None
+    # the trajectories of all cells are written into one preallocated array
+    n_t = len(t) * 2 if integration_direction == "both" else len(t)
+    Y = np.empty((n_cell * n_t, n_feature))
     if interpolation_num is not None:
         valid_ids = None
     for i in tqdm(range(n_cell), desc="integrating vector field"):
@@ -2112,7 +2007,7 @@ def integrate_vf(
         elif integration_direction == "both":
             y_f = odeint(lambda x, t: f(x), y0, t, args=args)
             y_b = odeint(lambda x, t: f(x), y0, -t, args=args)
-            y = np.hstack((y_b[::-1, :], y_f))
+            y = np.vstack((y_b[::-1, :], y_f))
             t_trans = np.hstack((-t[::-1], t))
 
             if interpolation_num is not None:
@@ -2124,27 +2019,25 @@ def integrate_vf(
             vids = np.where((np.diff(y.T) < 1e-3).sum(0) < y.shape[1])[0]
             valid_ids = vids if valid_ids is None else list(set(valid_ids).union(vids))
 
-        Y = y if Y is None else np.vstack((Y, y))
+        Y[i * n_t : (i + 1) * n_t] = y
 
     if interpolation_num is not None:
         valid_t_trans = t_trans[valid_ids]
 
-        _t, _Y = None, None
+        _t, _Y = np.empty(n_cell * interpolation_num), np.empty((n_feature, n_cell * interpolation_num))
         for i in range(n_cell):
             ind_vec = np.arange(i, (i + 1) * len(t_trans))
             cur_Y = Y[ind_vec, :][valid_ids, :]
             t_linspace = np.linspace(valid_t_trans[0], valid_t_trans[-1], interpolation_num)
             f = interpolate.interp1d(valid_t_trans, cur_Y.T)
-            _Y = f(t_linspace) if _Y is None else np.hstack((_Y, f(t_linspace)))
-            _t = t_linspace if _t is None else np.hstack((_t, t_linspace))
+            _Y[:, i * interpolation_num : (i + 1) * interpolation_num] = f(t_linspace)
+            _t[i * interpolation_num : (i + 1) * interpolation_num] = t_linspace
 
         t, Y = _t, _Y.T
 
     if n_cell > 1 and average:
-        t_len = int(len(t) / n_cell)
-        for i in range(t_len):
-            avg[i, :] = np.mean(Y[np.arange(n_cell) * t_len + i, :], 0)
-        Y = avg
+        # rows are laid out as (cell, time step), so averaging over cells is a reduction over the first axis
+        Y = Y.reshape((n_cell, -1, n_feature)).mean(0)
 
     return t, Y
 
@@ -2165,14 +2058,14 @@ def fetch_states(adata, init_states, init_cells, basis, layer, average, t_end):
     elif init_states is None and init_cells is not None:
         if type(init_cells) == str:
             init_cells = [init_cells]
-        intersect_cell_names = sorted(
-            set(init_cells).intersection(adata.obs_names),
-            key=lambda x: list(init_cells).index(x),
-        )
+        uniq_cells = pd.Index(init_cells).unique()
+        intersect_cell_names = list(uniq_cells[uniq_cells.isin(adata.obs_names)])
         _cell_names = init_cells if len(intersect_cell_names) == 0 else intersect_cell_names
+        # index the underlying arrays directly instead of building AnnData views of the slices
+        cell_idx = init_cells if len(intersect_cell_names) == 0 else adata.obs_names.get_indexer(intersect_cell_names)
 
         if basis is not None:
-            init_states = adata[_cell_names].obsm["X_" + basis].copy()
+            init_states = adata.obsm["X_" + basis][cell_idx]
             if len(_cell_names) == 1:
                 init_states = init_states.reshape((1, -1))
             VecFld = adata.uns["VecFld_" + basis]
@@ -2187,25 +2080,19 @@ def fetch_states(adata, init_states, init_cells, basis, layer, average, t_end):
 
             vf_key = "VecFld" if layer == "X" else "VecFld_" + layer
             valid_genes = adata.uns[vf_key]["genes"]
-            init_states = (
-                adata[_cell_names, :][:, valid_genes].X
-                if layer == "X"
-                else log1p_(adata, adata[_cell_names, :][:, valid_genes].layers[layer])
-            )
-            if sp.issparse(init_states):
-                init_states = init_states.A
+            gene_idx = adata.var_names.get_indexer(valid_genes)
+            if (gene_idx < 0).any():
+                raise KeyError(f"Genes {list(np.array(valid_genes)[gene_idx < 0])} are not in adata.var_names.")
+
+            X = adata.X[:, gene_idx] if layer == "X" else log1p_(adata, adata.layers[layer][:, gene_idx])
+            init_states = X[cell_idx]
             if len(_cell_names) == 1:
                 init_states = init_states.reshape((1, -1))
-
-            if layer == "X":
-                VecFld = adata.uns["VecFld"]
-                X = adata[:, valid_genes].X
-            else:
-                VecFld = adata.uns["VecFld_" + layer]
-                X = log1p_(adata, adata[:, valid_genes].layers[layer])
+            VecFld = adata.uns["VecFld"] if layer == "X" else adata.uns["VecFld_" + layer]
 
     if init_states.shape[0] > 1 and average in ["origin", "trajectory", True]:
-        init_states = init_states.mean(0).reshape((1, -1))
+        # a sparse mean is a dense (1, n) matrix, so only the averaged state gets densified
+        init_states = np.asarray(init_states.mean(0)).reshape((1, -1))
 
     if t_end is None:
         t_end = getTend(X, VecFld["V"])
@@ -2217,17 +2104,21 @@ def fetch_states(adata, init_states, init_cells, basis, layer, average, t_end):
 
 
 def getTend(X, V):
-    xmin, xmax = X.min(0), X.max(0)
+    # the largest per-dimension span of the states, without densifying a sparse X
+    span = (X.max(0) - X.min(0)).toarray() if sp.issparse(X) else np.ptp(X, 0)
     V_abs = np.abs(V)
-    t_end = np.max(xmax - xmin) / np.percentile(V_abs[V_abs > 0], 1)
+    t_end = np.max(span) / np.percentile(V_abs[V_abs > 0], 1)
 
     return t_end
 
 
-def getTseq(init_states, t_end, step_size=None):
+def getTseq(init_states, t_end, step_size=None, n_steps=250):
+    """Get the time points for integrating from the initial states, either `n_steps` evenly spaced points in
+    [0, t_end] or, if `step_size` is given, points spaced by it. `init_states` is kept for backward compatibility and
+    no longer affects the number of time points."""
     if step_size is None:
-        max_steps = int(max(7 / (init_states.shape[1] / 300), 4)) if init_states.shape[1] > 300 else 7
-        t_linspace = np.linspace(0, t_end, 10 ** (np.min([int(np.log10(t_end)), max_steps])))
+        # the ivp solvers pick their own steps within [0, t_end], so a modest grid is enough
+        t_linspace = np.linspace(0, t_end, n_steps)
     else:
         t_linspace = np.arange(0, t_end + step_size, step_size)
 
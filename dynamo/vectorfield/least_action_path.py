@@ -24,9 +24,7 @@ def action_grad(path, vf_func, jac_func, D=1, dt=1):
 
     dv = v - vf_func(x)
     J = jac_func(x)
-    z = np.zeros(dv.shape)
-    for s in range(dv.shape[0]):
-        z[s] = dv[s] @ J[:, :, s]
+    z = np.einsum("si, ijs -> sj", dv, J)
     grad = (dv[:-1] - dv[1:]) / D - dt / (2 * D) * (z[:-1] + z[1:])
     return grad
 
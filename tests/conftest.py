@@ -92,3 +92,14 @@ def adata(utils):
         return ZEBRAFISH_ADATA
     ZEBRAFISH_ADATA = utils.gen_or_read_zebrafish_data()
     return ZEBRAFISH_ADATA
+
+
+@pytest.fixture(scope="session")
+def zebrafish_raw():
+    # loaded once per test session; tests get their own copy through the `zebrafish` fixture
+    return dyn.sample_data.zebrafish()
+
+
+@pytest.fixture
+def zebrafish(zebrafish_raw):
+    return zebrafish_raw.copy()
@@ -48,8 +48,8 @@ def test_broken_neighbors_check_recompute(adata):
     assert check_neighbors_completeness(_adata)
 
 
-def test_neighbors_no_pca_key():
-    adata = dyn.sample_data.zebrafish()
+def test_neighbors_no_pca_key(zebrafish):
+    adata = zebrafish
     dyn.tl.neighbors(adata)
 
 
@@ -0,0 +1,146 @@
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.linalg import expm
+from scipy.optimize import approx_fprime
+
+from dynamo.prediction.fate import _fate
+from dynamo.prediction.least_action_path import (
+    LeastActionPath,
+    action,
+    action_and_grad_aux,
+    action_aux,
+    action_grad_aux,
+    get_init_path,
+    lap_T,
+)
+from dynamo.prediction.utils import integrate_vf_ivp
+
+A = np.array([[-0.2, 1.0], [-1.0, -0.2]])
+
+
+def linear_vf(x):
+    return x @ A.T
+
+
+def linear_solution(x0, t):
+    return np.array([expm(A * t_i) @ x0 for t_i in t]).T
+
+
+def test_integrate_vf_ivp_batch():
+    init_states = np.array([[1.0, 0.0], [0.0, 2.0], [-1.5, 0.5]])
+    t = np.linspace(0, 5, 250)
+
+    for direction, sampling in [("forward", "arc_length"), ("both", "arc_length"), ("forward", "logspace")]:
+        t_cell, Y_cell = integrate_vf_ivp(
+            init_states, t, direction, linear_vf, interpolation_num=50, sampling=sampling, disable=True
+        )
+        t_batch, Y_batch = integrate_vf_ivp(
+            init_states,
+            t,
+            direction,
+            linear_vf,
+            interpolation_num=50,
+            sampling=sampling,
+            disable=True,
+            args=(),
+            batch=True,
+        )
+
+        for i in range(init_states.shape[0]):
+            assert np.allclose(Y_cell[i], linear_solution(init_states[i], t_cell[i]), atol=1e-4)
+            assert np.allclose(Y_batch[i], linear_solution(init_states[i], t_batch[i]), atol=1e-4)
+            if sampling == "arc_length":
+                # samples are evenly spaced along each cell's own trajectory
+                step_cell = np.linalg.norm(np.diff(Y_cell[i], axis=1), axis=0)
+                step_batch = np.linalg.norm(np.diff(Y_batch[i], axis=1), axis=0)
+                assert step_cell.max() / step_cell.min() < 1.1
+                assert step_batch.max() / step_batch.min() < 1.1
+                assert np.isclose(np.median(step_batch), np.median(step_cell), rtol=1e-2)
+            else:
+                assert np.allclose(t_batch[i], t_cell[i])
+                assert np.allclose(Y_batch[i], Y_cell[i], atol=1e-4)
+
+
+def test_fate_multiple_cores():
+    init_states = np.array([[1.0, 0.0], [0.0, 2.0], [-1.5, 0.5]])
+
+    for sampling in ["arc_length", "logspace"]:
+        t, prediction = _fate(linear_vf, init_states, t_end=5, interpolation_num=20, average=False, sampling=sampling)
+        t_mc, prediction_mc = _fate(
+            linear_vf, init_states, t_end=5, interpolation_num=20, average=False, sampling=sampling, cores=2
+        )
+        for i in range(init_states.shape[0]):
+            assert np.allclose(t_mc[i], t[i])
+            assert np.allclose(prediction_mc[i], prediction[i])
+
+
+def test_lap_cumulative_action():
+    X = np.random.RandomState(0).rand(15, 2)
+    D, dt = 2, 0.3
+    lap = LeastActionPath(X, linear_vf, D=D, dt=dt)
+
+    prefix_action = [0] + [action(X[: i + 1], linear_vf, D=D, dt=dt) for i in range(1, len(X))]
+    assert np.allclose(lap.action(), prefix_action)
+
+
+def linear_jac(x):
+    return np.repeat(A[:, :, None], len(x), axis=2)
+
+
+def test_action_grad():
+    def vf(x):
+        return np.sin(x[:, ::-1] * 3) + x @ A.T
+
+    def jac(x):
+        J = np.repeat(A[:, :, None], len(x), axis=2)
+        J[0, 1] += 3 * np.cos(3 * x[:, 1])
+        J[1, 0] += 3 * np.cos(3 * x[:, 0])
+        return J
+
+    start, end = np.array([1.0, 0.0]), np.array([0.0, 1.0])
+    path_flatten = np.random.RandomState(0).rand(20)
+    kwargs = {"start": start, "end": end, "D": 2, "dt": 0.3}
+
+    grad = action_grad_aux(path_flatten, vf, jac, 2, **kwargs)
+    grad_fd = approx_fprime(path_flatten, lambda x: action_aux(x, vf, 2, **kwargs), 1e-7)
+    assert np.allclose(grad, grad_fd, atol=1e-5)
+
+    s, grad_fused = action_and_grad_aux(path_flatten, vf, jac, 2, **kwargs)
+    assert np.isclose(s, action_aux(path_flatten, vf, 2, **kwargs))
+    assert np.allclose(grad_fused, grad)
+
+
+def test_lap_T_sine_modes():
+    start, end = np.array([1.0, 0.0]), np.array([0.0, 1.0])
+    path_0 = start + np.linspace(0, 1, 21)[:, None] * (end - start)
+    T = 2.0
+    dt = T / (len(path_0) - 1)
+
+    for n_modes in [None, 5]:
+        path, _, _ = lap_T(path_0, T, linear_vf, linear_jac, n_modes=n_modes)
+        assert path.shape == path_0.shape
+        assert np.allclose(path[0], start) and np.allclose(path[-1], end)
+        assert action(path, linear_vf, dt=dt) < action(path_0, linear_vf, dt=dt)
+
+
+def test_get_init_path_sparse_graph():
+    rng = np.random.RandomState(0)
+    coords = rng.rand(60, 2)
+    # a random tree, so that the shortest path between any two nodes is unique
+    parents = [rng.randint(i) for i in range(1, 60)]
+    adj = sp.csr_matrix((rng.rand(59), (parents, np.arange(1, 60))), shape=(60, 60))
+    start, end = coords[3] + 1e-3, coords[40] - 1e-3
+
+    path_nx = get_init_path(nx.from_scipy_sparse_matrix(adj), start, end, coords, interpolation_num=10)
+    path_sp = get_init_path(adj, start, end, coords, interpolation_num=10)
+    assert np.allclose(path_nx, path_sp)
+
+
+if __name__ == "__main__":
+    test_integrate_vf_ivp_batch()
+    test_fate_multiple_cores()
+    test_lap_cumulative_action()
+    test_action_grad()
+    test_lap_T_sine_modes()
+    test_get_init_path_sparse_graph()
@@ -1,9 +1,7 @@
 import anndata
 import numpy as np
-import pandas as pd
-import scipy
+import pytest
 import scipy.sparse
-from scipy import sparse
 from scipy.sparse.csr import csr_matrix
 
 # from utils import *
@@ -19,7 +17,7 @@ from dynamo.preprocessing.preprocessor_utils import (
     log1p_adata,
     select_genes_by_dispersion_general,
 )
-from dynamo.preprocessing.utils import convert_layers2csr
+from dynamo.preprocessing.utils import convert_layers2csr, pca_monocle
 
 SHOW_FIG = False
 
@@ -94,15 +92,13 @@ def test_recipe_monocle_feature_selection_layer_simple0():
     rpe1_kinetics.obs["time"] = rpe1_kinetics.obs["time"].astype(float)
     rpe1_kinetics = rpe1_kinetics[rpe1_kinetics.obs.time != -1, :]
 
-    rpe1_kinetics.layers["new"], rpe1_kinetics.layers["total"] = (
-        rpe1_kinetics.layers["ul"] + rpe1_kinetics.layers["sl"],
-        rpe1_kinetics.layers["su"]
-        + rpe1_kinetics.layers["sl"]
-        + rpe1_kinetics.layers["uu"]
-        + rpe1_kinetics.layers["ul"],
-    )
-
-    del rpe1_kinetics.layers["uu"], rpe1_kinetics.layers["ul"], rpe1_kinetics.layers["su"], rpe1_kinetics.layers["sl"]
+    # total = new + unlabeled; reuse new instead of summing the labeled layers twice
+    rpe1_kinetics.layers["new"] = rpe1_kinetics.layers["ul"] + rpe1_kinetics.layers["sl"]
+    del rpe1_kinetics.layers["ul"], rpe1_kinetics.layers["sl"]
+    rpe1_kinetics.layers["total"] = rpe1_kinetics.layers["new"] + rpe1_kinetics.layers["su"]
+    del rpe1_kinetics.layers["su"]
+    rpe1_kinetics.layers["total"] += rpe1_kinetics.layers["uu"]
+    del rpe1_kinetics.layers["uu"]
     dyn.pl.basic_stats(rpe1_kinetics, save_show_or_return="return")
     rpe1_genes = ["UNG", "PCNA", "PLK1", "HPRT1"]
 
@@ -110,21 +106,37 @@ def test_recipe_monocle_feature_selection_layer_simple0():
     dyn.pp.recipe_monocle(rpe1_kinetics, n_top_genes=1000, total_layers=False, feature_selection_layer="new")
 
 
-def test_calc_dispersion_sparse():
+def test_calc_dispersion_sparse(monkeypatch):
     # TODO add randomize tests
     sparse_mat = csr_matrix([[1, 2, 0, 1, 5], [0, 0, 3, 1, 299], [4, 0, 5, 1, 399]])
-    mean, var, dispersion = calc_mean_var_dispersion_sparse(sparse_mat)
-    expected_mean = np.mean(sparse_mat.toarray(), axis=0)
-    expected_var = np.var(sparse_mat.toarray(), axis=0)
+
+    # sparse-only references, so that the test data never gets densified either
+    def expected_mean_var(axis):
+        n = sparse_mat.shape[axis]
+        mean = np.asarray(sparse_mat.sum(axis=axis)).ravel() / n
+        var = np.asarray(sparse_mat.multiply(sparse_mat).sum(axis=axis)).ravel() / n - mean ** 2
+        return mean, var
+
+    expected_mean, expected_var = expected_mean_var(0)
     expected_dispersion = expected_var / expected_mean
-    print("mean:", mean)
-    print("expected mean:", expected_mean)
-    print("var:", mean)
-    print("expected var:", expected_mean)
+    expected_mean_1, expected_var_1 = expected_mean_var(1)
+
+    def no_densify(*args, **kwargs):
+        raise AssertionError("calc_mean_var_dispersion_sparse should not densify its input")
+
+    for sparse_format in [scipy.sparse.csr_matrix, scipy.sparse.csc_matrix]:
+        monkeypatch.setattr(sparse_format, "toarray", no_densify)
+        monkeypatch.setattr(sparse_format, "todense", no_densify)
+
+    mean, var, dispersion = calc_mean_var_dispersion_sparse(sparse_mat)
     assert np.all(np.isclose(mean, expected_mean))
     assert np.all(np.isclose(var, expected_var))
     assert np.all(np.isclose(dispersion, expected_dispersion))
 
+    mean, var, dispersion = calc_mean_var_dispersion_sparse(sparse_mat, axis=1)
+    assert np.all(np.isclose(mean, expected_mean_1))
+    assert np.all(np.isclose(var, expected_var_1))
+
     # TODO adapt to seurat_get_mean_var test
     # sc_mean, sc_var = dyn.preprocessing.preprocessor_utils.seurat_get_mean_var(sparse_mat)
     # print("sc_mean:", sc_mean)
@@ -140,15 +152,15 @@ def test_Preprocessor_simple_run(adata):
     preprocess_worker.preprocess_adata_monocle(adata)
 
 
-def test_is_log_transformed():
-    adata = dyn.sample_data.zebrafish()
+def test_is_log_transformed(zebrafish):
+    adata = zebrafish
     assert not is_log1p_transformed_adata(adata)
     log1p_adata(adata)
     assert is_log1p_transformed_adata(adata)
 
 
-def test_layers2csr_matrix():
-    adata = dyn.sample_data.zebrafish()
+def test_layers2csr_matrix(zebrafish):
+    adata = zebrafish
     adata = adata[100:]
     convert_layers2csr(adata)
     for key in adata.layers.keys():
@@ -165,48 +177,54 @@ def test_compute_gene_exp_fraction():
     assert np.all(np.isclose(frac.flatten(), [2 / 5, 3 / 5]))
 
 
-def test_preprocessor_seurat(adata):
-    adata = dyn.sample_data.zebrafish()
+def test_pca_sparse():
+    X = scipy.sparse.random(500, 100, density=0.2, format="csr", random_state=0)
+    adata_sparse, fit_sparse, X_pca_sparse = pca_monocle(
+        anndata.AnnData(X, dtype=np.float64), n_pca_components=10, pca_key="X_pca", return_all=True
+    )
+    adata_dense, fit_dense, X_pca_dense = pca_monocle(
+        anndata.AnnData(X.toarray(), dtype=np.float64), n_pca_components=10, pca_key="X_pca", return_all=True
+    )
+    # the sign convention has to match the dense solver, not only the subspace
+    assert np.array_equal(np.sign(fit_sparse.components_.sum(1)), np.sign(fit_dense.components_.sum(1)))
+    assert np.allclose(fit_sparse.components_, fit_dense.components_, atol=1e-8)
+    assert np.allclose(X_pca_sparse, X_pca_dense, atol=1e-8)
+    assert np.allclose(fit_sparse.explained_variance_ratio_, fit_dense.explained_variance_ratio_)
+    assert np.allclose(fit_sparse.transform(X.toarray()), X_pca_dense, atol=1e-8)
+
+
+def test_preprocessor_seurat(zebrafish):
+    adata = zebrafish
     preprocessor = dyn.pp.Preprocessor()
     preprocessor.preprocess_adata(adata, recipe="seurat")
     # TODO add assert comparison later. Now checked by notebooks only.
 
 
-def test_is_nonnegative():
-    test_mat = csr_matrix([[1, 2, 0, 1, 5], [0, 0, 3, 1, 299], [4, 0, 5, 1, 399]])
-    assert is_integer_arr(test_mat)
-    assert is_nonnegative(test_mat)
-    assert is_nonnegative_integer_arr(test_mat)
-    test_mat = test_mat.toarray()
-    assert is_integer_arr(test_mat)
-    assert is_nonnegative(test_mat)
-    assert is_nonnegative_integer_arr(test_mat)
-
-    test_mat = csr_matrix([[-1, 2, 0, 1, 5], [0, 0, 3, 1, 299], [4, 0, 5, 1, 399]])
-    assert is_integer_arr(test_mat)
-    assert not is_nonnegative(test_mat)
-    test_mat = test_mat.toarray()
-    assert is_integer_arr(test_mat)
-    assert not is_nonnegative(test_mat)
-
-    test_mat = csr_matrix([[0, 2, 0, 1, 5], [0, 0, -3, 1, 299], [4, 0, 5, -1, 399]])
-    assert is_integer_arr(test_mat)
-    assert not is_nonnegative(test_mat)
-    test_mat = test_mat.toarray()
-    assert is_integer_arr(test_mat)
-    assert not is_nonnegative(test_mat)
-
-    test_mat = csr_matrix([[0, 2, 0, 1, 5], [0, 0, 5, 1, 299], [4, 0, 5, 5, 399]], dtype=float)
-    assert is_float_integer_arr(test_mat)
-    assert is_nonnegative_integer_arr(test_mat)
-    test_mat = test_mat.toarray()
-    assert is_float_integer_arr(test_mat)
-    assert is_nonnegative_integer_arr(test_mat)
-
-    test_mat = csr_matrix([[0, 2, 0, 1, 5], [0, 0, -3, 1, 299], [4, 0, 5, -1, 399.1]], dtype=float)
-    assert not is_nonnegative_integer_arr(test_mat)
-    test_mat = test_mat.toarray()
-    assert not is_nonnegative_integer_arr(test_mat)
+@pytest.mark.parametrize("densify", [False, True])
+@pytest.mark.parametrize(
+    "mat, dtype, expected",
+    [
+        (
+            [[1, 2, 0, 1, 5], [0, 0, 3, 1, 299], [4, 0, 5, 1, 399]],
+            int,
+            {is_integer_arr: True, is_nonnegative: True, is_nonnegative_integer_arr: True},
+        ),
+        ([[-1, 2, 0, 1, 5], [0, 0, 3, 1, 299], [4, 0, 5, 1, 399]], int, {is_integer_arr: True, is_nonnegative: False}),
+        ([[0, 2, 0, 1, 5], [0, 0, -3, 1, 299], [4, 0, 5, -1, 399]], int, {is_integer_arr: True, is_nonnegative: False}),
+        (
+            [[0, 2, 0, 1, 5], [0, 0, 5, 1, 299], [4, 0, 5, 5, 399]],
+            float,
+            {is_float_integer_arr: True, is_nonnegative_integer_arr: True},
+        ),
+        ([[0, 2, 0, 1, 5], [0, 0, -3, 1, 299], [4, 0, 5, -1, 399.1]], float, {is_nonnegative_integer_arr: False}),
+    ],
+)
+def test_is_nonnegative(mat, dtype, expected, densify):
+    test_mat = csr_matrix(mat, dtype=dtype)
+    if densify:
+        test_mat = test_mat.toarray()
+    for predicate, value in expected.items():
+        assert predicate(test_mat) == value
 
 
 if __name__ == "__main__":
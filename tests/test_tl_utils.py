@@ -34,6 +34,37 @@ def test_smallest_distance_simple_random():
     assert abs(smallest_distance_bf(coords) - dynamo.tl.compute_smallest_distance(coords)) < 1e-8
 
 
+def test_append_iterative_neighbor_indices_padded():
+    from dynamo.tools.utils import append_iterative_neighbor_indices
+
+    # -1 marks a missing neighbor, as in the output of pynndescent
+    indices = np.array([[0, 1, -1], [1, 2, 0], [2, 3, -1], [3, 2, -1]])
+    expected = [[0, 1, 2], [0, 1, 2, 3], [2, 3], [2, 3]]
+
+    res = append_iterative_neighbor_indices(indices, n_recurse_neighbors=2)
+    assert len(res) == len(expected)
+    assert all(np.array_equal(r, e) for r, e in zip(res, expected))
+
+
+def test_einsum_correlation_near_constant_row():
+    from dynamo.tools.utils import einsum_correlation
+
+    rng = np.random.RandomState(0)
+    X = rng.rand(3, 50)
+    X[1] = 7 + 1e-7 * rng.rand(50)
+    X[2] += 1e6
+    Y = rng.rand(50)
+    X_orig, Y_orig = X.copy(), Y.copy()
+
+    corr = einsum_correlation(X, Y, type="pearson")
+    expected = [np.corrcoef(x, Y)[0, 1] for x in X]
+    assert np.all(np.isfinite(corr))
+    assert np.allclose(corr.ravel(), expected, atol=1e-6)
+    assert np.array_equal(X, X_orig) and np.array_equal(Y, Y_orig)
+
+
 if __name__ == "__main__":
     test_smallest_distance_simple_1()
     test_smallest_distance_simple_random()
+    test_append_iterative_neighbor_indices_padded()
+    test_einsum_correlation_near_constant_row()